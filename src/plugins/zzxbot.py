@@ -1,19 +1,56 @@
 import asyncio
 import base64
+import contextvars
+import cProfile
+import gzip
+import hashlib
+import heapq
+import inspect
+import io
+import itertools
 import json
+import math
 import os
+import pstats
+import random
 import re
+import secrets
+import shutil
+import sqlite3
+import struct
+import sys
+import threading
 import time
 import traceback
-from typing import Any
+import unicodedata
+import zlib
+from array import array
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable
 
 import httpx
 from httpx import Response
-from nonebot import on_command, on_request, on_notice, on_message
+from nonebot import on_request, on_notice, on_message, get_driver, get_bots
 from nonebot.adapters.onebot.v11 import Event, GroupRequestEvent, GroupDecreaseNoticeEvent, \
     FriendRequestEvent, \
-    Bot, GroupIncreaseNoticeEvent, Message, GroupMessageEvent, ActionFailed, GroupBanNoticeEvent
+    Bot, GroupIncreaseNoticeEvent, Message, MessageSegment, GroupMessageEvent, ActionFailed, GroupBanNoticeEvent
+from nonebot.compat import model_dump
+from nonebot.exception import IgnoredException, MatcherException, NetworkError
 from nonebot.matcher import Matcher
+from nonebot.message import event_preprocessor, event_postprocessor, run_postprocessor
+from nonebot.typing import T_State
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # 没有numpy时不渲染皮肤
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None  # 没有Pillow时不检查图片
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -24,13 +61,124 @@ BOT_DOC = f"""{BOT_NAME}
 By LunarCN dev
 Website: {BOT_WEBSITE}"""
 
+driver = get_driver()
+
+
+class SharedStore(object):
+    """多进程/多节点共享的键值存储 (SQLite WAL)
+
+    每个值按 (namespace, key) 单独保存, 写入时分配全局递增的 rev,
+    其他进程通过 poll() 拉取 rev 更大的记录并通知订阅者, 删除以 NULL 墓碑表示"""
+
+    def __init__(self, path: str):
+        object.__init__(self)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS kv ("
+                          "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT, rev INTEGER NOT NULL, "
+                          "PRIMARY KEY (namespace, key))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS kv_rev ON kv (rev)")
+        self.rev: int = self.conn.execute("SELECT COALESCE(MAX(rev), 0) FROM kv").fetchone()[0]
+        self.data_version = self._data_version()
+        self.listeners: dict[str, list[Callable[[str, Any], None]]] = {}
+
+    def _data_version(self) -> int:
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE, 保证读-改-写在多个进程间是原子的"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _write(self, conn: sqlite3.Connection, namespace: str, key: str, value: Any):
+        rev = conn.execute("SELECT COALESCE(MAX(rev), 0) + 1 FROM kv").fetchone()[0]
+        dumped = None if value is None else json.dumps(value, ensure_ascii=False)
+        conn.execute("INSERT INTO kv (namespace, key, value, rev) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, rev = excluded.rev",
+                     (namespace, key, dumped, rev))
+
+    def load(self, namespace: str) -> dict:
+        rows = self.conn.execute("SELECT key, value FROM kv WHERE namespace = ? AND value IS NOT NULL", (namespace,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        row = self.conn.execute("SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+        if row is None or row[0] is None:
+            return default
+        return json.loads(row[0])
+
+    def put(self, namespace: str, key: str, value: Any):
+        with self.transaction() as conn:
+            self._write(conn, namespace, key, value)
+
+    def put_many(self, namespace: str, items: dict[str, Any]):
+        """在一个事务中写入多个值"""
+        with self.transaction() as conn:
+            for key, value in items.items():
+                self._write(conn, namespace, key, value)
+
+    def delete(self, namespace: str, key: str):
+        with self.transaction() as conn:
+            self._write(conn, namespace, key, None)
+
+    def update(self, namespace: str, key: str, func: Callable[[Any], Any]) -> Any:
+        """原子地读取-修改-写入一个值, func 返回 None 表示删除"""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            old = None if row is None or row[0] is None else json.loads(row[0])
+            new = func(old)
+            if new != old:
+                self._write(conn, namespace, key, new)
+            return new
+
+    def subscribe(self, namespace: str, listener: Callable[[str, Any], None]):
+        self.listeners.setdefault(namespace, []).append(listener)
+
+    def poll(self) -> int:
+        """拉取其他进程的修改并通知订阅者, 返回变更条数"""
+        data_version = self._data_version()
+        if data_version == self.data_version:
+            return 0  # 没有其他连接提交过
+        self.data_version = data_version
+        rows = self.conn.execute("SELECT namespace, key, value, rev FROM kv WHERE rev > ? ORDER BY rev",
+                                 (self.rev,)).fetchall()
+        for namespace, key, value, rev in rows:
+            self.rev = rev
+            for listener in self.listeners.get(namespace, []):
+                listener(key, None if value is None else json.loads(value))
+        return len(rows)
+
+
+def open_store() -> SharedStore | None:
+    """根据 .env 中的 ZZXBOT_STORE 打开共享存储, 未配置时使用本地json"""
+    path = getattr(driver.config, "zzxbot_store", None)
+    if not path:
+        return None
+    path = path if os.path.isabs(path) else os.path.join(BASE_DIR, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return SharedStore(path)
+
+
+store = open_store()
+
 
 class BotUtils(object):
 
-    def __init__(self):
+    def __init__(self, store: SharedStore | None = None):
         object.__init__(self)
 
         self.config: dict = {}
+        self.store = store
+        self.synced: dict[str, str] = {}  # 已写入共享存储的值
+        self.revision = 0  # 配置每次修改后加一, 用于判断根据配置预处理的数据是否过期
         self.config_dir = os.path.join(BASE_DIR, "config")
         if not os.path.isdir(self.config_dir):
             os.makedirs(self.config_dir)
@@ -41,18 +189,58 @@ class BotUtils(object):
         self.init_bot()  # 初始化机器人
 
     def load(self):
-        if not os.path.isfile(self.config_json):
+        if self.store is not None:
+            self.store.subscribe("config", self.on_store_change)
+            if not self.store.load("config") and os.path.isfile(self.config_json):
+                # 首次启用共享存储, 迁移本地配置
+                with open(self.config_json, "r", encoding="UTF-8") as f:
+                    self.config = json.load(f)
+                self.save()
+        elif not os.path.isfile(self.config_json):
             self.save()
         self.reload()  # same logic
 
     def reload(self):
+        self.revision += 1
+        if self.store is not None:
+            self.config = {"modules": {}}
+            self.synced = {}
+            for key, value in self.store.load("config").items():
+                self.on_store_change(key, value)
+            return
         with open(self.config_json, "r", encoding="UTF-8") as f:
             self.config: dict = json.load(f)
 
     def save(self):
+        self.revision += 1
+        if self.store is not None:
+            # 只写入发生变化的部分, 避免覆盖其他进程对别的模块的修改
+            entries = {f"modules/{name}": module for name, module in self.config.get("modules", {}).items()}
+            if "bot" in self.config:
+                entries["bot"] = self.config["bot"]
+            for key, value in entries.items():
+                dumped = json.dumps(value, sort_keys=True, ensure_ascii=False)
+                if self.synced.get(key) != dumped:
+                    self.store.put("config", key, value)
+                    self.synced[key] = dumped
+            return
         with open(self.config_json, "w", encoding="utf-8") as f:
             json.dump(self.config, f, indent=4, ensure_ascii=False)
 
+    def on_store_change(self, key: str, value: Any):
+        """共享存储中的配置被修改"""
+        self.revision += 1
+        if key.startswith("modules/"):
+            modules = self.config.setdefault("modules", {})
+            name = key[len("modules/"):]
+            if value is None:
+                modules.pop(name, None)
+            else:
+                modules[name] = value
+        elif value is not None:
+            self.config[key] = value
+        self.synced[key] = json.dumps(value, sort_keys=True, ensure_ascii=False)
+
     def init_bot(self):
         if "bot" not in self.config:
             self.config["bot"] = {
@@ -96,11 +284,15 @@ class BotUtils(object):
     def get_admins(self) -> list[str]:
         return self.config["bot"]["admins"]
 
+    def get_notify_groups(self) -> list[str]:
+        return self.config["bot"].get("notify-groups", [])
+
 
 class BlackList(object):
-    def __init__(self):
+    def __init__(self, store: SharedStore | None = None):
         object.__init__(self)
         self.config: dict = {}
+        self.store = store
         self.config_dir = os.path.join(BASE_DIR, "config")
         self.bl_json = os.path.join(self.config_dir, "black-list.json")
 
@@ -108,15 +300,31 @@ class BlackList(object):
         self.__init()
 
     def load(self):
+        if self.store is not None:
+            self.store.subscribe("black-list", self.on_store_change)
+            if os.path.isfile(self.bl_json) and not self.store.load("black-list"):
+                with open(self.bl_json, "r", encoding="UTF-8") as f:
+                    for uid, entry in json.load(f).get("black-list", {}).items():
+                        self.store.put("black-list", uid, entry)
+            self.config = {"black-list": self.store.load("black-list")}
+            return
         if not os.path.isfile(self.bl_json):
             self.save()
         with open(self.bl_json, "r", encoding="UTF-8") as f:
             self.config: dict = json.load(f)
 
     def save(self):
+        if self.store is not None:
+            return  # 共享存储模式下每个条目单独写入
         with open(self.bl_json, "w", encoding="utf-8") as f:
             json.dump(self.config, f, indent=4, ensure_ascii=False)
 
+    def on_store_change(self, uid: str, entry: dict | None):
+        if entry is None:
+            self.config["black-list"].pop(uid, None)
+        else:
+            self.config["black-list"][uid] = entry
+
     def __init(self):
         if "black-list" not in self.config:
             self.config["black-list"] = {}
@@ -126,23 +334,94 @@ class BlackList(object):
         return self.config["black-list"]
 
     def in_black_list(self, uid: str):
-        return uid in self.config["black-list"]
+        entry = self.config["black-list"].get(uid)
+        return entry is not None and (entry.get("expire") is None or entry["expire"] > time.time())
 
-    def add_user(self, uid: str, reason: str = "idk"):
-        self.config["black-list"][uid] = {"reason": reason, "add-date": time.time()}
+    def add_user(self, uid: str, reason: str = "idk", expire: float | None = None):
+        self.config["black-list"][uid] = {"reason": reason, "add-date": time.time(), "expire": expire}
+        if self.store is not None:
+            self.store.put("black-list", uid, self.config["black-list"][uid])
         self.save()
 
     def remove_user(self, uid: str):
         del self.config["black-list"][uid]
+        if self.store is not None:
+            self.store.delete("black-list", uid)
         self.save()
 
     def get_user(self, uid: str):
         return self.config["black-list"][uid]
 
 
+class TTLCache(object):
+    """带过期时间的LRU缓存"""
+
+    def __init__(self, max_size: int, ttl: float):
+        object.__init__(self)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data: OrderedDict[Any, tuple[float, Any]] = OrderedDict()  # key -> (过期时间, value)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        item = self.data.get(key)
+        if item is None:
+            return default
+        if item[0] < time.time():
+            del self.data[key]
+            return default
+        self.data.move_to_end(key)
+        return item[1]
+
+    def set(self, key: Any, value: Any, ttl: float | None = None):
+        self.data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def discard(self, key: Any):
+        self.data.pop(key, None)
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, self) is not self
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class SingleFlight(object):
+    """同一个key同时只执行一次, 其他调用者等待同一个结果"""
+
+    def __init__(self):
+        object.__init__(self)
+        self.pending: dict[Any, asyncio.Future] = {}
+
+    async def run(self, key: Any, factory: Callable[[], Awaitable]) -> Any:
+        if key not in self.pending:
+            self.pending[key] = asyncio.ensure_future(factory())
+            self.pending[key].add_done_callback(lambda _: self.pending.pop(key, None))
+        return await asyncio.shield(self.pending[key])
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.pending
+
+
+user_names = TTLCache(4096, 600)
+
+
 async def get_user_name(bot: Bot, uid: str):
     """获取用户名"""
-    return (await bot.get_stranger_info(user_id=int(uid), no_cache=True))["nickname"]
+    name = user_names.get(uid)
+    if name is None:
+        name = (await bot.get_stranger_info(user_id=int(uid), no_cache=True))["nickname"]
+        user_names.set(uid, name)
+    return name
+
+
+async def get_user_names(bot: Bot, uids: list[str]) -> dict[str, str]:
+    """并发获取多个用户名, 获取失败时使用uid代替"""
+    uids = list(dict.fromkeys(uids))
+    names = await asyncio.gather(*(get_user_name(bot, uid) for uid in uids), return_exceptions=True)
+    return {uid: name if isinstance(name, str) else uid for uid, name in zip(uids, names)}
 
 
 async def get_group_name(bot: Bot, gid):
@@ -150,8 +429,583 @@ async def get_group_name(bot: Bot, gid):
     return (await bot.get_group_info(group_id=int(gid), no_cache=True))["group_name"]
 
 
-utils = BotUtils()
-black_list = BlackList()
+async def notify_groups(message: str):
+    """向 bot.notify-groups 中的群发送通知"""
+    bot = next(iter(get_bots().values()), None)
+    if bot is None:
+        return
+    for gid in utils.get_notify_groups():
+        try:
+            await bot_pool.call(bot, "send_group_msg", {"group_id": int(gid), "message": message})
+        except (ActionFailed, NetworkError):
+            pass
+
+
+utils = BotUtils(store)
+black_list = BlackList(store)
+
+
+async def watch_store(interval: float):
+    """定时拉取共享存储中其他进程的修改"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            store.poll()
+        except sqlite3.Error:
+            traceback.print_exc()
+
+
+background_tasks: set[asyncio.Task] = set()
+
+
+def run_background(coro) -> asyncio.Task:
+    """创建后台任务并保留引用, 防止被回收"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+@driver.on_startup
+async def on_startup_store():
+    if store is not None:
+        run_background(watch_store(float(getattr(driver.config, "zzxbot_store_poll_interval", 1))))
+
+
+# Module AuditLog start
+class AuditLog(object):
+    """只追加的管理操作日志
+
+    日志按段写入 audit/segment-N.jsonl, 超过 segment-size 后压缩为 segment-N.jsonl.gz;
+    index.db 记录每个uid/群号出现在哪些段里, 查询时只需要读取相关的段.
+    write() 只放入内存缓冲区, 由后台任务在线程中写入磁盘, 不会阻塞消息处理"""
+
+    def __init__(self, log_dir: str):
+        object.__init__(self)
+        self.log_dir = log_dir
+        if not os.path.isdir(self.log_dir):
+            os.makedirs(self.log_dir)
+        self.lock = threading.Lock()
+        self.buffer: list[dict] = []
+        self.index = sqlite3.connect(os.path.join(log_dir, "index.db"), check_same_thread=False)
+        self.index.execute("CREATE TABLE IF NOT EXISTS postings ("
+                           "key TEXT NOT NULL, segment INTEGER NOT NULL, PRIMARY KEY (key, segment)) WITHOUT ROWID")
+        segments = []
+        for name in os.listdir(self.log_dir):
+            match = re.fullmatch(r"segment-(\d+)\.jsonl(\.gz)?", name)
+            if match:
+                segments.append(int(match.group(1)))
+        self.segment = max(segments, default=0)
+        if os.path.isfile(self.segment_path(self.segment, True)):
+            self.segment += 1  # 最后一段已经压缩
+
+    def segment_path(self, segment: int, compressed: bool = False) -> str:
+        return os.path.join(self.log_dir, f"segment-{segment}.jsonl" + (".gz" if compressed else ""))
+
+    def write(self, action: str, **fields):
+        entry = {"time": time.time(), "action": action}
+        entry.update({key: str(value) for key, value in fields.items() if value is not None})
+        self.buffer.append(entry)
+
+    def append(self, entries: list[dict]):
+        with self.lock:
+            path = self.segment_path(self.segment)
+            with open(path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+            keys = {f"{prefix}:{entry[field]}" for entry in entries
+                    for prefix, field in (("u", "uid"), ("g", "gid")) if field in entry}
+            with self.index:
+                self.index.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?)",
+                                       [(key, self.segment) for key in keys])
+            if os.path.getsize(path) > utils.init_value("audit", "segment-size") * 1024 * 1024:
+                with open(path, "rb") as src, gzip.open(self.segment_path(self.segment, True), "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(path)
+                self.segment += 1
+
+    def read_segment(self, segment: int) -> list[dict]:
+        path = self.segment_path(segment)
+        if os.path.isfile(path):
+            f = open(path, "r", encoding="utf-8")
+        else:
+            f = gzip.open(self.segment_path(segment, True), "rt", encoding="utf-8")
+        entries = []
+        with f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+        return entries
+
+    def query(self, field: str, value: str, actions: tuple[str, ...] | None, limit: int) -> list[dict]:
+        """按时间倒序返回匹配的条目"""
+        with self.lock:
+            key = ("u:" if field == "uid" else "g:") + value
+            segments = [row[0] for row in self.index.execute(
+                "SELECT segment FROM postings WHERE key = ? ORDER BY segment DESC", (key,))]
+            result = []
+            for segment in segments:
+                for entry in reversed(self.read_segment(segment)):
+                    if entry.get(field) == value and (actions is None or entry["action"] in actions):
+                        result.append(entry)
+                        if len(result) >= limit:
+                            return result
+            return result
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        entries, self.buffer = self.buffer, []
+        await asyncio.to_thread(self.append, entries)
+
+    async def search(self, *, uid: str | None = None, gid: str | None = None,
+                     actions: tuple[str, ...] | None = None, limit: int = 20) -> list[dict]:
+        await self.flush()
+        field, value = ("uid", uid) if uid is not None else ("gid", gid)
+        return await asyncio.to_thread(self.query, field, value, actions, limit)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(1)
+            try:
+                await self.flush()
+            except OSError:
+                traceback.print_exc()
+
+
+def format_audit_entry(entry: dict) -> str:
+    line = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["time"])) + " " + entry["action"]
+    details = [f"{key}={value}" for key, value in entry.items() if key not in ("time", "action")]
+    return line + (" " + " ".join(details) if details else "")
+
+
+utils.init_module("audit")
+utils.init_value("audit", "segment-size", 4)  # 单个日志段的大小上限(MB), 超过后压缩
+audit_log = AuditLog(os.path.join(utils.config_dir, "audit"))
+
+
+@driver.on_startup
+async def on_startup_audit():
+    run_background(audit_log.run())
+
+
+@driver.on_shutdown
+async def on_shutdown_audit():
+    await audit_log.flush()
+
+
+# Module AuditLog end
+
+# Module Scheduler start
+class Scheduler(object):
+    """定时任务调度器
+
+    所有定时任务放在一个最小堆里, 只有一个后台协程等待最早到期的任务;
+    persist=True 的任务保存在SQLite中, 重启后继续执行, 多个进程共用数据库时由删除成功的进程执行(见 claim)"""
+
+    def __init__(self, path: str):
+        object.__init__(self)
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                          "id TEXT PRIMARY KEY, due REAL NOT NULL, type TEXT NOT NULL, args TEXT NOT NULL)")
+        self.heap: list[tuple[float, int, str]] = []  # (到期时间, 序号, id), 被替换或取消的条目在弹出时跳过
+        self.jobs: dict[str, dict] = {}  # id -> {"due", "type", "args", "interval", "persist", "seq"}
+        self.handlers: dict[str, Callable[[dict], Awaitable]] = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        for job_id, due, job_type, args in self.conn.execute("SELECT id, due, type, args FROM jobs"):
+            self.push(job_id, {"due": due, "type": job_type, "args": json.loads(args), "interval": None,
+                               "persist": True})
+
+    def push(self, job_id: str, job: dict):
+        job["seq"] = next(self.counter)
+        self.jobs[job_id] = job
+        heapq.heappush(self.heap, (job["due"], job["seq"], job_id))
+
+    def register(self, job_type: str, handler: Callable[[dict], Awaitable]):
+        self.handlers[job_type] = handler
+
+    def schedule(self, job_id: str, due: float, job_type: str, args: dict | None = None, *,
+                 interval: float | None = None, persist: bool = True):
+        """添加或替换任务, interval不为None时为周期任务(不会持久化)"""
+        persist = persist and interval is None
+        self.push(job_id, {"due": due, "type": job_type, "args": args or {}, "interval": interval,
+                           "persist": persist})
+        if persist:
+            self.conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)",
+                              (job_id, due, job_type, json.dumps(args or {}, ensure_ascii=False)))
+        if self.heap[0][2] == job_id:
+            self.wakeup.set()  # 新任务比当前等待的更早
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.jobs.pop(job_id, None)
+        if job is not None and job["persist"]:
+            self.conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return job is not None
+
+    def pop_due(self, now: float) -> list[dict]:
+        due_jobs = []
+        while self.heap and self.heap[0][0] <= now:
+            _, seq, job_id = heapq.heappop(self.heap)
+            job = self.jobs.get(job_id)
+            if job is None or job["seq"] != seq:
+                continue  # 已取消或已替换
+            if job["interval"] is not None:
+                # 错过的周期不补执行
+                self.push(job_id, dict(job, due=max(job["due"] + job["interval"], now)))
+            else:
+                del self.jobs[job_id]
+                if job["persist"] and not self.claim(job_id, job["due"]):
+                    continue  # 已被其他进程执行或改期
+            due_jobs.append(job)
+        return due_jobs
+
+    def claim(self, job_id: str, due: float) -> bool:
+        """按 (id, 到期时间) 删除数据库中的任务, 删除成功的进程执行任务
+
+        其他进程改期后(due不同)不会删除新任务, 而是把新任务重新放进本进程的堆里"""
+        if self.conn.execute("DELETE FROM jobs WHERE id = ? AND due = ?", (job_id, due)).rowcount:
+            return True
+        row = self.conn.execute("SELECT due, type, args FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is not None and job_id not in self.jobs:
+            self.push(job_id, {"due": row[0], "type": row[1], "args": json.loads(row[2]), "interval": None,
+                               "persist": True})
+        return False
+
+    async def execute(self, job: dict):
+        handler = self.handlers.get(job["type"])
+        if handler is None:
+            return
+        try:
+            await handler(job["args"])
+        except Exception:
+            traceback.print_exc()
+
+    async def run(self):
+        while True:
+            while self.heap and self.jobs.get(self.heap[0][2], {}).get("seq") != self.heap[0][1]:
+                heapq.heappop(self.heap)
+            timeout = max(self.heap[0][0] - time.time(), 0) if self.heap else None
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            for job in self.pop_due(time.time()):
+                run_background(self.execute(job))
+
+
+scheduler = Scheduler(store.path if store is not None else os.path.join(utils.config_dir, "scheduler.db"))
+
+
+@driver.on_startup
+async def on_startup_scheduler():
+    run_background(scheduler.run())
+
+
+# Module Scheduler end
+
+# Module Tracing start
+class Span(object):
+    """一次操作的耗时记录, 字段与 OTLP JSON 的 Span 对应"""
+
+    def __init__(self, trace: "Trace", name: str, parent: "Span | None", attributes: dict):
+        object.__init__(self)
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.attributes = attributes
+        self.start = time.time_ns()
+        self.end: int | None = None
+        self.error: str | None = None
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def finish(self, error: BaseException | str | None = None):
+        if self.end is not None:
+            return
+        self.end = time.time_ns()
+        if error is not None:
+            self.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+        self.trace.on_finish(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error is not None else {"code": 1}
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+
+def otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Trace(object):
+    """一个事件产生的所有span, 根span结束时决定是否写出
+
+    head采样: 创建时按 sample-rate 决定; 未被采样但总耗时超过 slow-threshold 的也会写出"""
+
+    def __init__(self, tracer: "Tracer", sampled: bool):
+        object.__init__(self)
+        self.tracer = tracer
+        self.trace_id = secrets.token_hex(16)
+        self.sampled = sampled
+        self.spans: list[Span] = []
+        self.root: Span | None = None
+        self.exported = False
+
+    def on_finish(self, span: Span):
+        if self.exported:
+            # 根span结束后才完成的span(后台任务等), 已导出的trace直接追加
+            self.tracer.export([span])
+            return
+        self.spans.append(span)
+        if span is not self.root:
+            return
+        duration = (span.end - span.start) / 1e6
+        if self.sampled or duration >= utils.init_value("tracing", "slow-threshold"):
+            self.exported = True
+            self.tracer.export(self.spans)
+        self.spans = []
+
+
+class Tracer(object):
+    """每个事件一个trace, 经过 matcher、bot API 调用和 get()/post() 传播
+
+    当前span保存在 ContextVar 中; nonebot 在独立的任务里运行预处理器和每个matcher,
+    所以根span放在事件的state里, 由每个matcher的第一个handler取出并设置为当前span.
+    写出的span按 OTLP JSON (resourceSpans) 每行一条追加到 traces/traces.jsonl, 超过 max-size 后轮转"""
+
+    def __init__(self, trace_dir: str):
+        object.__init__(self)
+        self.trace_dir = trace_dir
+        self.current: contextvars.ContextVar[Span | None] = contextvars.ContextVar("zzxbot_span", default=None)
+        self.buffer: list[Span] = []
+        self.calls: dict[int, Span] = {}  # id(data) -> bot API span
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.trace_dir, "traces.jsonl")
+
+    def start_trace(self, name: str, **attributes) -> Span:
+        trace = Trace(self, random.random() < utils.init_value("tracing", "sample-rate"))
+        trace.root = Span(trace, name, None, attributes)
+        return trace.root
+
+    def start_span(self, name: str, parent: Span | None = None, **attributes) -> Span | None:
+        parent = parent or self.current.get()
+        if parent is None:
+            return None
+        return Span(parent.trace, name, parent, attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """在当前trace中记录一个子span, 没有trace时什么也不做"""
+        span = self.start_span(name, **attributes)
+        if span is None:
+            yield None
+            return
+        token = self.current.set(span)
+        try:
+            yield span
+        except MatcherException:
+            raise  # finish/pause/reject/skip 是正常的控制流程, 不算错误
+        except BaseException as e:
+            span.finish(e)
+            raise
+        finally:
+            self.current.reset(token)
+            span.finish()
+
+    def export(self, spans: list[Span]):
+        self.buffer.extend(spans)
+
+    def append(self, spans: list[Span]):
+        os.makedirs(self.trace_dir, exist_ok=True)
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": BOT_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "zzxbot"}, "spans": [span.to_otlp() for span in spans]}]
+        }]}, ensure_ascii=False)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        if os.path.getsize(self.path) > utils.init_value("tracing", "max-size") * 1024 * 1024:
+            self.rotate()
+
+    def rotate(self):
+        backups = utils.init_value("tracing", "backups")
+        for i in range(backups - 1, 0, -1):
+            if os.path.isfile(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        spans, self.buffer = self.buffer, []
+        await asyncio.to_thread(self.append, spans)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(1)
+            try:
+                await self.flush()
+            except OSError:
+                traceback.print_exc()
+
+
+utils.init_module("tracing")
+utils.init_value("tracing", "sample-rate", 0.01)  # 随机采样比例
+utils.init_value("tracing", "slow-threshold", 1000)  # 超过该耗时(ms)的事件总是记录
+utils.init_value("tracing", "max-size", 16)  # 单个文件大小上限(MB)
+utils.init_value("tracing", "backups", 3)  # 保留的轮转文件数
+tracer = Tracer(os.path.join(utils.config_dir, "traces"))
+
+
+@event_preprocessor
+async def trace_event_start(event: Event, state: T_State):
+    if not utils.get_state("tracing"):
+        return
+    state["trace"] = tracer.start_trace(f"event {event.get_event_name()}", **{
+        "event.type": event.get_type(),
+        "event.name": event.get_event_name(),
+        "user.id": getattr(event, "user_id", None) or "",
+        "group.id": getattr(event, "group_id", None) or ""
+    })
+
+
+@event_postprocessor
+async def trace_event_end(state: T_State):
+    if "trace" in state:
+        state["trace"].finish()
+
+
+async def trace_matcher(matcher: Matcher, state: T_State):
+    """放在每个matcher的第一个handler, 在matcher所在的任务里设置当前span"""
+    root: Span | None = state.get("trace")
+    if root is None:
+        return
+    handler = matcher.handlers[-1].call
+    span = tracer.start_span(f"matcher {handler.__name__}:{handler.__code__.co_firstlineno}", root,
+                             **{"matcher.type": matcher.type, "matcher.priority": matcher.priority,
+                                "matcher.plugin": matcher.plugin_name or ""})
+    state["span"] = span
+    tracer.current.set(span)
+
+
+@run_postprocessor
+async def trace_matcher_end(matcher: Matcher, exception: Exception | None):
+    span: Span | None = matcher.state.get("span")
+    if span is not None:
+        span.finish(exception)
+
+
+@Bot.on_calling_api
+async def trace_api_start(bot: Bot, api: str, data: dict):
+    span = tracer.start_span(f"bot.{api}", **{"bot.self_id": bot.self_id, "onebot.action": api})
+    if span is not None:
+        tracer.calls[id(data)] = span
+
+
+@Bot.on_called_api
+async def trace_api_end(bot: Bot, exception: Exception | None, api: str, data: dict, result: Any):
+    span = tracer.calls.pop(id(data), None)
+    if span is not None:
+        span.finish(exception)
+
+
+@driver.on_startup
+async def on_startup_tracing():
+    run_background(tracer.run())
+
+
+@driver.on_shutdown
+async def on_shutdown_tracing():
+    await tracer.flush()
+
+
+# Module Tracing end
+
+# Module EventDedupe start
+class EventDedupe(object):
+    """高可用模式下的事件去重
+
+    同一个账号连接了多个go-cqhttp时, 按 (self_id, message_id) 去掉重复收到的事件;
+    多个账号在同一个群里时, 同一条群消息/通知/请求会由每个账号各上报一次, 这些事件的 message_id 和 flag 不同,
+    所以按去掉账号相关字段后的指纹去重, 只处理第一个账号收到的. 记录按时间和数量两方面限制大小"""
+
+    account_fields = {"self_id", "message_id", "flag", "to_me", "message", "original_message", "reply"}
+
+    def __init__(self, max_size: int, ttl: float):
+        object.__init__(self)
+        self.seen = TTLCache(max_size, ttl)  # (self_id, message_id/flag/指纹) -> True
+        self.owners = TTLCache(max_size, ttl)  # 指纹 -> 第一个收到的账号
+
+    def fingerprint(self, event: Event) -> str | None:
+        if event.get_type() == "meta_event" or getattr(event, "message_type", None) == "private":
+            return None  # 私聊消息发给的是不同的账号, 不算重复
+        if getattr(event, "request_type", None) == "friend" or getattr(event, "sub_type", None) == "invite":
+            return None  # 好友请求和邀请机器人入群同样是发给某个账号的, 只按 (self_id, flag) 去重
+        data = model_dump(event, exclude=self.account_fields)
+        return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def is_duplicate(self, event: Event) -> bool:
+        if event.get_type() == "meta_event":
+            return False
+        self_id = str(event.self_id)
+        fingerprint = self.fingerprint(event)
+        own = (self_id, getattr(event, "message_id", None) or getattr(event, "flag", None) or fingerprint)
+        if own[1] is not None:
+            if own in self.seen:
+                return True
+            self.seen.set(own, True)
+        if fingerprint is not None:
+            owner = self.owners.get(fingerprint)
+            if owner is None:
+                self.owners.set(fingerprint, self_id)
+            elif owner != self_id:
+                return True
+        return False
+
+
+utils.init_module("event-dedupe")
+utils.init_value("event-dedupe", "ttl", 120)  # 记录保留时间(秒)
+utils.init_value("event-dedupe", "max-size", 65536)  # 最多记录的事件数
+event_dedupe = EventDedupe(utils.init_value("event-dedupe", "max-size"), utils.init_value("event-dedupe", "ttl"))
+
+
+@event_preprocessor
+async def dedupe_event(event: Event):
+    if not utils.get_state("event-dedupe") or not event_dedupe.is_duplicate(event):
+        return
+    metrics["event-dedupe.hits"] += 1
+    metrics[f"event-dedupe.hits.{event.get_type()}"] += 1
+    raise IgnoredException("duplicate event")
+
+
+# Module EventDedupe end
 
 
 def check(module_id: str, event: Event, *, admin: bool = False):
@@ -164,30 +1018,667 @@ def is_admin(event: Event):
     return event.get_user_id() in utils.get_admins()
 
 
-def parse_arg(arg_str: str) -> list:
-    return arg_str.split(" ")[1:]
+def parse_duration(text: str) -> int | None:
+    """解析时长, 纯数字为分钟, 也支持 1d12h / 2h30m / 45s 的写法, 返回秒数"""
+    if text.isdigit():
+        return int(text) * 60
+    match = re.fullmatch(r"(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?", text.lower())
+    if match is None or not any(match.groups()):
+        return None
+    days, hours, minutes, seconds = (int(group or 0) for group in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+# Module Command start
+class Arg(object):
+    """命令参数
+
+    kind 把单个参数转换成需要的类型, 抛出 ValueError 或返回 None 表示参数错误;
+    rest=True 把剩下的原始文本(保留中间的空格)整体转换, many=True 逐个转换剩下的所有参数组成列表;
+    default 为 ... 表示必填"""
+
+    def __init__(self, name: str, kind: Callable[[str], Any] = str, *, default: Any = ..., rest: bool = False,
+                 many: bool = False):
+        object.__init__(self)
+        self.name = name
+        self.kind = kind
+        self.default = [] if many and default is ... else default
+        self.rest = rest
+        self.many = many
+
+
+def choice(*options: str) -> Callable[[str], str]:
+    """只接受给定值之一的参数类型"""
+
+    def kind(value: str) -> str:
+        if value not in options:
+            raise ValueError(value)
+        return value
+
+    return kind
+
+
+def uid(value: str) -> str:
+    """QQ号/群号参数, 保持字符串"""
+    if not value.isdigit():
+        raise ValueError(value)
+    return value
+
+
+class CommandSpec(object):
+    def __init__(self, name: str, handler: Callable[..., Awaitable], aliases: set[str], module: str | None,
+                 admin: bool, args: list[Arg], usage: str | None, limit: str | None):
+        object.__init__(self)
+        self.name = name
+        self.handler = handler
+        self.aliases = aliases
+        self.module = module
+        self.admin = admin
+        self.args = args
+        self.usage = usage
+        self.limit = limit  # 限流分组, 见 rate-limit.limits
+        parameters = inspect.signature(handler).parameters
+        self.params = set(parameters)
+        # 和nonebot一样, 按event参数的类型注解限制事件类型(例如只能在群里使用)
+        annotation = parameters["event"].annotation if "event" in parameters else Event
+        self.event_type = annotation if isinstance(annotation, type) else Event
+
+    def allowed(self, event: Event) -> bool:
+        if not isinstance(event, self.event_type):
+            return False
+        if self.module is not None and not utils.get_state(self.module):
+            return False
+        return not self.admin or is_admin(event)
+
+    def parse(self, text: str) -> dict | None:
+        """按参数定义解析, 参数错误时返回None"""
+        tokens = list(re.finditer(r"\S+", text))
+        values = {}
+        i = 0
+        for arg in self.args:
+            if i < len(tokens):
+                try:
+                    if arg.rest:
+                        value = arg.kind(text[tokens[i].start():].rstrip())
+                    elif arg.many:
+                        value = [arg.kind(token.group()) for token in tokens[i:]]
+                    else:
+                        value = arg.kind(tokens[i].group())
+                except ValueError:
+                    return None
+                if value is None or (arg.many and None in value):
+                    return None
+                values[arg.name] = value
+                i = len(tokens) if arg.rest or arg.many else i + 1
+            elif arg.default is not ...:
+                values[arg.name] = arg.default
+            else:
+                return None
+        return values if i == len(tokens) else None
+
+
+class CommandRegistry(object):
+    """声明式注册的命令, 由一个message matcher分发
+
+    命令名和别名(加上command_start)放在一棵字符前缀树里, 在rule中完成查找、模块开关和管理员检查,
+    不满足条件的消息不会创建handler任务; 参数只解析一次, 按名字传给handler"""
+
+    def __init__(self):
+        object.__init__(self)
+        self.trie: dict = {}
+        self.starts = sorted(driver.config.command_start, key=len, reverse=True)
+
+    def register(self, name: str, *, aliases: set[str] | None = None, module: str | None = None,
+                 admin: bool = False, args: list[Arg] | None = None, usage: str | None = None,
+                 limit: str | None = None):
+        def decorator(func: Callable[..., Awaitable]):
+            spec = CommandSpec(name, func, aliases or set(), module, admin, args or [], usage, limit)
+            for key in (name, *spec.aliases):
+                for start in self.starts:
+                    node = self.trie
+                    for char in start + key:
+                        node = node.setdefault(char, {})
+                    node[""] = spec
+            return func
+
+        return decorator
+
+    def lookup(self, text: str) -> tuple[CommandSpec, str] | None:
+        """最长匹配, 命令后面必须是空白或结尾, 返回 (命令, 剩余文本)"""
+        node = self.trie
+        found = None
+        for i, char in enumerate(text):
+            node = node.get(char)
+            if node is None:
+                break
+            if "" in node and (i + 1 == len(text) or text[i + 1].isspace()):
+                found = (node[""], text[i + 1:])
+        return found
+
+    async def match(self, event: Event, state: T_State) -> bool:
+        if event.get_type() != "message":
+            return False
+        found = self.lookup(event.get_plaintext().lstrip())
+        if found is None or not found[0].allowed(event):
+            return False
+        spec, text = found
+        state["command"] = spec
+        state["args"] = spec.parse(text)
+        return True
+
+    async def dispatch(self, matcher: Matcher, bot: Bot, event: Event, state: T_State):
+        spec: CommandSpec = state["command"]
+        args: dict | None = state["args"]
+        if args is None:
+            await matcher.finish(spec.usage)
+        if spec.limit is not None:
+            wait, notify = rate_limiter.take(spec.limit, event)
+            if wait:
+                metrics[f"rate-limit.{spec.limit}.throttled"] += 1
+                # 同一段冷却只提示一次, 之后的请求直接忽略
+                await matcher.finish(f"[RateLimit] 请求太频繁, 请在{math.ceil(wait)}秒后再试" if notify else None)
+        available = {"matcher": matcher, "bot": bot, "event": event, **args}
+        with tracer.span(f"command {spec.name}", command=spec.name):
+            await spec.handler(**{name: value for name, value in available.items() if name in spec.params})
+
+
+commands = CommandRegistry()
+command = commands.register
+on_message(rule=commands.match, priority=1, handlers=[trace_matcher, commands.dispatch])
+
+
+# Module Command end
+
+
+# Module RateLimit start
+class RateLimiter(object):
+    """令牌桶限流, 同时按 (用户, 分组) 和 (群, 分组) 计数
+
+    桶的状态存放在几个定长数组里, key 只映射到下标; 桶回满后和新建的桶没有区别,
+    定期清理时直接回收这些下标, 所以空闲用户不占内存. 管理员不受限制"""
+
+    def __init__(self):
+        object.__init__(self)
+        self.slots: dict[tuple[str, str, str], int] = {}  # (scope, id, 分组) -> 下标
+        self.tokens = array("d")
+        self.updated = array("d")  # 上次更新 tokens 的时间
+        self.full_at = array("d")  # 回满的时间, 之后可以回收
+        self.notified = array("b")  # 用户在本次冷却中是否已经提示过(只用于用户的桶)
+        self.free: list[int] = []
+        self.last_sweep = time.monotonic()
+
+    def slot(self, key: tuple[str, str, str], burst: float, now: float) -> int:
+        index = self.slots.get(key)
+        if index is not None:
+            return index
+        if self.free:
+            index = self.free.pop()
+            self.tokens[index], self.updated[index], self.full_at[index], self.notified[index] = burst, now, now, 0
+        else:
+            index = len(self.tokens)
+            self.tokens.append(burst)
+            self.updated.append(now)
+            self.full_at.append(now)
+            self.notified.append(0)
+        self.slots[key] = index
+        return index
+
+    def refill(self, index: int, burst: float, rate: float, now: float) -> float:
+        tokens = min(burst, self.tokens[index] + (now - self.updated[index]) * rate)
+        self.tokens[index] = tokens
+        self.updated[index] = now
+        return tokens
+
+    def take(self, limit: str, event: Event) -> tuple[float, bool]:
+        """消耗一个令牌, 返回 (需要等待的秒数, 是否需要提示); 等待为0表示放行"""
+        config = utils.init_value("rate-limit", "limits").get(limit)
+        if config is None or not utils.get_state("rate-limit") or is_admin(event):
+            return 0, False
+        now = time.monotonic()
+        if now - self.last_sweep > utils.init_value("rate-limit", "sweep-interval"):
+            self.sweep(now)
+        # 提示状态记在用户自己的桶上, 所以即使没有配置用户限制也要分配
+        user = self.slot(("user", event.get_user_id(), limit), float(config.get("user", {}).get("burst", 1)), now)
+        buckets = [(user, config.get("user"))]
+        if isinstance(event, GroupMessageEvent) and "group" in config:
+            group = self.slot(("group", str(event.group_id), limit), float(config["group"]["burst"]), now)
+            buckets.append((group, config["group"]))
+        checked = []
+        wait = 0
+        for index, limits in buckets:
+            if limits is None:
+                continue
+            burst, rate = float(limits["burst"]), limits["per-minute"] / 60
+            tokens = self.refill(index, burst, rate, now)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+            checked.append((index, burst, rate))
+        if wait:
+            # 任意一个桶不够时都不扣令牌; 每个用户在一次冷却中只提示一次, 冷却结束前不回收用户的桶
+            notify = not self.notified[user]
+            self.notified[user] = 1
+            self.full_at[user] = max(self.full_at[user], now + wait)
+            return wait, notify
+        for index, burst, rate in checked:
+            self.tokens[index] -= 1
+            self.full_at[index] = now + (burst - self.tokens[index]) / rate
+        self.notified[user] = 0
+        return 0, False
+
+    def sweep(self, now: float):
+        """回收已经回满的桶"""
+        self.last_sweep = now
+        for key, index in list(self.slots.items()):
+            if self.full_at[index] <= now:
+                del self.slots[key]
+                self.free.append(index)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+
+utils.init_module("rate-limit")
+# 分组 -> {"user": 每个用户的限制, "group": 每个群的限制}, burst 为桶容量, per-minute 为每分钟恢复的次数
+utils.init_value("rate-limit", "limits", {
+    "mojang": {"user": {"burst": 3, "per-minute": 6}, "group": {"burst": 10, "per-minute": 20}},
+    "optifine": {"user": {"burst": 3, "per-minute": 6}, "group": {"burst": 10, "per-minute": 20}},
+    "hypixel": {"user": {"burst": 2, "per-minute": 4}, "group": {"burst": 6, "per-minute": 12}},
+    "bilibili": {"user": {"burst": 3, "per-minute": 6}, "group": {"burst": 10, "per-minute": 20}},
+    "lunarclient": {"user": {"burst": 2, "per-minute": 4}, "group": {"burst": 6, "per-minute": 12}}
+})
+utils.init_value("rate-limit", "sweep-interval", 60)  # 回收空闲桶的间隔(秒)
+rate_limiter = RateLimiter()
+
+
+# Module RateLimit end
+
+
+# Module ActionExecutor start
+metrics: Counter[str] = Counter()  # 运行时计数, 通过 /metrics 查看
+
+
+# Module BotPool start
+class BotPool(object):
+    """多个账号在同一批群里时分担管理操作
+
+    每个操作从所在群的账号中选择负载最低的(需要管理员权限的操作只选管理员账号),
+    账号断线或被风控时暂时跳过并换下一个账号重试. 带 message_id 的操作和私聊操作只能由收到事件的账号执行"""
+
+    admin_actions = {"set_group_ban", "set_group_kick", "set_group_card", "set_group_whole_ban", "set_group_name",
+                     "set_group_special_title", "set_group_add_request"}
+
+    def __init__(self):
+        object.__init__(self)
+        self.groups = TTLCache(64, 600)  # self_id -> 所在群号
+        self.roles = TTLCache(4096, 600)  # (self_id, 群号) -> 群身份
+        self.inflight: Counter[str] = Counter()
+        self.recent: dict[str, deque[float]] = {}  # self_id -> 最近一分钟的调用时间
+        self.down_until: dict[str, float] = {}
+
+    def load(self, self_id: str) -> int:
+        recent = self.recent.setdefault(self_id, deque())
+        while recent and recent[0] < time.time() - 60:
+            recent.popleft()
+        return self.inflight[self_id] * 10 + len(recent)
+
+    async def capable(self, bot: Bot, gid: int, admin: bool) -> bool:
+        try:
+            if bot.self_id not in self.groups:
+                self.groups.set(bot.self_id, {group["group_id"] for group in await bot.get_group_list()})
+            if gid not in self.groups.get(bot.self_id):
+                return False
+            if not admin:
+                return True
+            if (bot.self_id, gid) not in self.roles:
+                info = await bot.get_group_member_info(group_id=gid, user_id=int(bot.self_id))
+                self.roles.set((bot.self_id, gid), info["role"])
+            return self.roles.get((bot.self_id, gid)) in ("admin", "owner")
+        except (ActionFailed, NetworkError):
+            return False
+
+    async def candidates(self, origin: Bot, api: str, data: dict) -> list[Bot]:
+        bots = [bot for bot in get_bots().values() if isinstance(bot, Bot)]
+        if not utils.get_state("bot-pool") or len(bots) <= 1 or "group_id" not in data or "message_id" in data:
+            return [origin]
+        gid = int(data["group_id"])
+        capable = await asyncio.gather(*(self.capable(bot, gid, api.removesuffix("_async") in self.admin_actions) for bot in bots))
+        now = time.time()
+        bots = [bot for bot, ok in zip(bots, capable) if ok and self.down_until.get(bot.self_id, 0) <= now]
+        return sorted(bots, key=lambda bot: (self.load(bot.self_id), bot is not origin)) or [origin]
+
+    async def call(self, origin: Bot, api: str, data: dict) -> Any:
+        error = None
+        for bot in await self.candidates(origin, api, data):
+            self.inflight[bot.self_id] += 1
+            self.recent.setdefault(bot.self_id, deque()).append(time.time())
+            try:
+                return await bot.call_api(api, **data)
+            except (ActionFailed, NetworkError) as e:
+                if isinstance(e, ActionFailed) and not is_risk_controlled(e):
+                    raise
+                error = e
+                self.down_until[bot.self_id] = time.time() + utils.init_value("bot-pool", "cooldown")
+                metrics[f"pool.{bot.self_id}.down"] += 1
+            finally:
+                self.inflight[bot.self_id] -= 1
+        raise error
+
+
+def is_risk_controlled(e: ActionFailed) -> bool:
+    """go-cqhttp 在账号被风控时返回 SEND_MSG_API_ERROR, 或者提示信息中包含"风控"字样"""
+    return e.info.get("msg") == "SEND_MSG_API_ERROR" or "风控" in str(e.info.get("wording", ""))
+
 
+utils.init_module("bot-pool")
+utils.init_value("bot-pool", "cooldown", 300)  # 账号被风控/断线后暂停使用的时间(秒)
+bot_pool = BotPool()
 
-async def get(url: str, timeout: float = 5, *args, **kwargs) -> Response:
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.get(url, *args, **kwargs)
+
+@driver.on_bot_connect
+async def on_pool_connect(bot: Bot):
+    bot_pool.down_until.pop(bot.self_id, None)
+    bot_pool.groups.discard(bot.self_id)
+
+
+# Module BotPool end
+
+class ActionExecutor(object):
+    """并发执行一组管理操作, 通过 bot_pool 选择执行的账号
+
+    同一个 (操作, 群, 用户) 在 dedupe-window 秒内只执行一次(更长的禁言和解除禁言除外), 连续违规时不会重复禁言/踢出/通知;
+    非关键操作(撤回、私信通知)使用 go-cqhttp 的 *_async 接口, 不等待操作完成.
+    每个操作的结果计入 metrics"""
+
+    def __init__(self, window: float):
+        object.__init__(self)
+        self.recent = TTLCache(4096, window)
+
+    async def call(self, bot: Bot, api: str, *, key: tuple | None = None, critical: bool = True, **data) -> Any:
+        """执行单个操作, 被去重或失败时返回None; key 为 (群, 用户)"""
+        if key is not None:
+            dedupe_key = (api, *key)
+            if self.redundant(self.recent.get(dedupe_key), data.get("duration")):
+                metrics[f"action.{api}.deduped"] += 1
+                return None
+            self.recent.set(dedupe_key, data.get("duration", True))
+        action = api + "_async" if not critical and utils.init_value("executor", "use-async") else api
+        try:
+            result = await bot_pool.call(bot, action, data)
+        except (ActionFailed, NetworkError):
+            metrics[f"action.{api}.failed"] += 1
+            if key is not None:
+                self.recent.discard(dedupe_key)  # 失败后允许重试
+            return None
+        metrics[f"action.{api}.ok"] += 1
+        return result
+
+    @staticmethod
+    def redundant(recorded: Any, duration: int | None) -> bool:
+        """窗口内已执行过相同或更强的操作; 禁言时长更长或解除禁言(0)时不去重"""
+        if recorded is None:
+            return False
+        if recorded is True or duration is None or recorded == duration:
+            return True
+        return 0 < duration <= recorded
+
+    async def run(self, *calls: Awaitable) -> list:
+        """同时执行多个互不依赖的操作"""
+        return list(await asyncio.gather(*calls))
+
+
+@command("metrics", admin=True, args=[Arg("prefix", default="")])
+async def on_handle(matcher: Matcher, prefix: str):
+    """查看运行时计数"""
+    lines = [f"{name}: {value}" for name, value in sorted(metrics.items()) if name.startswith(prefix)]
+    await matcher.finish("[Metrics] " + ("\n" + "\n".join(lines) if lines else "暂无数据"))
+
+
+utils.init_module("executor")
+utils.init_value("executor", "dedupe-window", 60)  # 同一操作对同一用户的去重时间(秒)
+utils.init_value("executor", "use-async", True)  # 非关键操作使用 *_async 接口
+executor = ActionExecutor(utils.init_value("executor", "dedupe-window"))
+
+
+# Module ActionExecutor end
+
+
+# Module RecentMessages start
+class RecentMessages(object):
+    """每个群最近的消息, 用于批量撤回某个用户的刷屏
+
+    每个群一个定长环形缓冲区, 记录 (message_id, uid, 时间, 收到消息的账号); message_id 只在收到它的账号上有效,
+    所以撤回时使用记录中的账号. 撤回分批并发执行, 批次之间间隔 purge-interval 秒"""
+
+    def __init__(self):
+        object.__init__(self)
+        self.groups: dict[int, deque[tuple[int, str, float, str]]] = {}
+
+    def add(self, gid: int, message_id: int, uid: str, self_id: str):
+        messages = self.groups.get(gid)
+        if messages is None:
+            messages = self.groups[gid] = deque(maxlen=utils.init_value("recent-messages", "size"))
+        messages.append((message_id, uid, time.time(), self_id))
+
+    def take(self, gid: int, uid: str, since: float) -> list[tuple[int, str]]:
+        """取出并移除用户在 since 之后的消息, 返回 (message_id, 账号)"""
+        messages = self.groups.get(gid)
+        if not messages:
+            return []
+        found = [(message_id, self_id) for message_id, sender, ts, self_id in messages
+                 if sender == uid and ts >= since]
+        if found:
+            self.groups[gid] = deque((entry for entry in messages if entry[1] != uid or entry[2] < since),
+                                     maxlen=messages.maxlen)
+        return found
+
+    async def purge(self, gid: int, uid: str, minutes: float | None = None, exclude: int | None = None) -> int:
+        """撤回用户最近 minutes 分钟内的消息, 返回撤回的条数"""
+        if minutes is None:
+            minutes = utils.init_value("recent-messages", "purge-minutes")
+        bots = get_bots()
+        calls = [executor.call(bots[self_id], "delete_msg", critical=False, message_id=message_id)
+                 for message_id, self_id in self.take(gid, uid, time.time() - minutes * 60)
+                 if message_id != exclude and self_id in bots]
+        batch = utils.init_value("recent-messages", "purge-batch")
+        for i in range(0, len(calls), batch):
+            if i:
+                await asyncio.sleep(utils.init_value("recent-messages", "purge-interval"))
+            await executor.run(*calls[i:i + batch])
+        metrics["recent-messages.purged"] += len(calls)
+        return len(calls)
+
+
+utils.init_module("recent-messages")
+utils.init_value("recent-messages", "size", 200)  # 每个群记录的消息数
+utils.init_value("recent-messages", "purge-minutes", 30)  # 踢出/黑名单时撤回多少分钟内的消息
+utils.init_value("recent-messages", "max-purge-minutes", 1440)  # /purge 时间范围的上限(分钟)
+utils.init_value("recent-messages", "purge-batch", 5)  # 每批撤回的消息数
+utils.init_value("recent-messages", "purge-interval", 1)  # 批次间隔(秒)
+recent_messages = RecentMessages()
+
+
+@event_preprocessor
+async def record_message(bot: Bot, event: GroupMessageEvent):
+    if utils.get_state("recent-messages"):
+        recent_messages.add(event.group_id, event.message_id, event.get_user_id(), bot.self_id)
+
+
+# Module RecentMessages end
+
+
+# Module HttpCache start
+class HttpCache(object):
+    """持久化的HTTP响应缓存 (SQLite)
+
+    按 http-cache.rules 中第一条匹配的规则决定缓存时间:
+    ttl 内直接返回, ttl + stale 内返回旧数据并在后台刷新, 上游出错时 stale-if-error 内返回旧数据.
+    数据库读写在线程池中执行, 不阻塞事件循环"""
+
+    dropped_headers = ("content-encoding", "content-length", "transfer-encoding")
+
+    def __init__(self, path: str):
+        object.__init__(self)
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self.conn.execute("VACUUM")  # auto_vacuum只有在VACUUM后才生效
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                          "key TEXT PRIMARY KEY, url TEXT NOT NULL, status INTEGER NOT NULL, headers TEXT NOT NULL, "
+                          "content BLOB NOT NULL, fetched REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.size: int = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.refreshing: set[str] = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key_of(method: str, url: str, params: Any, body: Any) -> str:
+        raw = json.dumps([method, url, params, body], sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def rule_of(method: str, url: str) -> dict | None:
+        for rule in utils.init_value("http-cache", "rules"):
+            if rule.get("method", "GET") == method and re.search(rule["pattern"], url):
+                return rule
+        return None
+
+    def load(self, key: str, method: str) -> tuple[Response, float] | None:
+        """返回缓存的响应和它的年龄(秒)"""
+        with self.lock:
+            row = self.conn.execute("SELECT url, status, headers, content, fetched FROM responses WHERE key = ?",
+                                    (key,)).fetchone()
+            if row is None:
+                return None
+            url, status, headers, content, fetched = row
+            now = time.time()
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        response = httpx.Response(status, headers=json.loads(headers), content=content,
+                                  request=httpx.Request(method, url))
+        return response, now - fetched
+
+    def store(self, key: str, response: Response):
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in self.dropped_headers]
+        content = response.content
+        size = len(content) + len(key) + len(str(response.url))
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  (key, str(response.url), response.status_code, json.dumps(headers), content, now,
+                                   now, size))
+            self.size += size - (old[0] if old else 0)
+            if self.size > utils.init_value("http-cache", "max-size") * 1024 * 1024:
+                self.compact()
+
+    def compact(self):
+        """按最近访问时间淘汰到上限的80%并回收空间, 调用者需持有 self.lock"""
+        target = utils.init_value("http-cache", "max-size") * 1024 * 1024 * 0.8
+        with self.conn:
+            rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+            for key, size in rows:
+                if self.size <= target:
+                    break
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+        self.conn.execute("PRAGMA incremental_vacuum")
+
+    async def refresh(self, key: str, send: Callable):
+        self.refreshing.add(key)
+        try:
+            response = await send()
+            if response.status_code == 200:
+                await asyncio.to_thread(self.store, key, response)
+        except httpx.HTTPError:
+            pass  # 上游出错时继续使用旧数据
+        except Exception:
+            traceback.print_exc()  # 例如数据库被锁或磁盘已满, 后台任务里没有调用者处理
+        finally:
+            self.refreshing.discard(key)
+
+    async def request(self, method: str, url: str, params: Any, body: Any, send: Callable) -> Response:
+        rule = self.rule_of(method, url) if utils.get_state("http-cache") else None
+        if rule is None:
+            return await send()
+        key = self.key_of(method, url, params, body)
+        cached = await asyncio.to_thread(self.load, key, method)
+        if cached is not None:
+            response, age = cached
+            if age < rule["ttl"]:
+                return response
+            if age < rule["ttl"] + rule.get("stale", 0):
+                if key not in self.refreshing:
+                    run_background(self.refresh(key, send))
+                return response
+        stale_if_error = cached is not None and cached[1] < rule["ttl"] + rule.get("stale-if-error", 0)
+        try:
+            response = await send()
+        except httpx.HTTPError:
+            if stale_if_error:
+                return cached[0]
+            raise
+        if response.status_code == 200:
+            await asyncio.to_thread(self.store, key, response)
+        elif response.status_code >= 500 and stale_if_error:
+            return cached[0]
+        return response
+
+
+utils.init_module("http-cache")
+utils.init_value("http-cache", "max-size", 64)  # 缓存上限(MB)
+utils.init_value("http-cache", "rules", [  # 按顺序匹配, 单位为秒
+    {"pattern": r"^https://api\.hypixel\.net/", "ttl": 60, "stale": 240, "stale-if-error": 86400},
+    {"pattern": r"^https://api\.bilibili\.com/x/web-interface/view\?", "ttl": 600, "stale": 3000,
+     "stale-if-error": 86400},
+    {"pattern": r"^https://api\.capes\.dev/", "ttl": 3600, "stale": 82800, "stale-if-error": 604800},
+    {"pattern": r"^https://sessionserver\.mojang\.com/session/minecraft/profile/", "ttl": 60, "stale": 540,
+     "stale-if-error": 86400},
+    {"pattern": r"/launcher/metadata", "ttl": 300, "stale": 3300, "stale-if-error": 604800},
+    {"pattern": r"/launcher/launch", "method": "POST", "ttl": 300, "stale": 3300, "stale-if-error": 604800}
+])
+http_cache = HttpCache(os.path.join(utils.config_dir, "http-cache.db"))
+
+
+async def get(url: str, timeout: float = 5, *args, cache: bool = True, **kwargs) -> Response:
+    async def send():
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            r = await client.get(url, *args, **kwargs)
+            return r
+
+    with tracer.span("HTTP GET", **{"http.method": "GET", "http.url": url}) as span:
+        if not cache:
+            r = await send()
+        else:
+            r = await http_cache.request("GET", url, kwargs.get("params"), None, send)
+        if span is not None:
+            span.set("http.status_code", r.status_code)
         return r
 
 
-async def post(url: str, params: dict, *args, **kwargs) -> Response:
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, params=params, *args, **kwargs)
+async def post(url: str, params: dict, *args, cache: bool = True, **kwargs) -> Response:
+    async def send():
+        async with httpx.AsyncClient() as client:
+            r = await client.post(url, params=params, *args, **kwargs)
+            return r
+
+    with tracer.span("HTTP POST", **{"http.method": "POST", "http.url": url}) as span:
+        if not cache:
+            r = await send()
+        else:
+            body = kwargs.get("data", kwargs.get("json", kwargs.get("content")))
+            r = await http_cache.request("POST", url, params, body, send)
+        if span is not None:
+            span.set("http.status_code", r.status_code)
         return r
 
 
-@on_command("toggle", priority=1, block=False).handle()
-async def on_handle(matcher: Matcher, event: Event):
-    if not is_admin(event):
-        return
-    arg = parse_arg(event.get_plaintext())
-    if len(arg) == 0:
-        await matcher.finish("[Toggle] 参数错误 -> /toggle <moduleName: string>")
-    module_name: str = arg[0]
+# Module HttpCache end
+
+
+@command("toggle", admin=True, args=[Arg("module_name")],
+         usage="[Toggle] 参数错误 -> /toggle <moduleName: string>")
+async def on_handle(matcher: Matcher, module_name: str):
     current_state: Any | bool = utils.get_state(module_name)
     if current_state is None:
         await matcher.finish(f"[Toggle] 模块 {module_name} 不存在")
@@ -196,35 +1687,38 @@ async def on_handle(matcher: Matcher, event: Event):
         f"[Toggle] 模块{module_name}状态切换成功, 现在状态为{'启用' if not current_state else '禁用'}")
 
 
-@on_command("bot").handle()
-async def on_handle(matcher: Matcher, event: Event):
+@command("bot")
+async def on_handle(matcher: Matcher):
     await matcher.finish(BOT_DOC)
 
 
-@on_command("reload").handle()
-async def on_handle(matcher: Matcher, event: Event):
-    if not is_admin(event):
-        return
+@command("reload", admin=True)
+async def on_handle(matcher: Matcher):
     utils.reload()
     await matcher.finish("[Bot] 已重新加载配置文件")
 
 
-@on_command("bl", aliases={"blacklist", "blocked"}).handle()
-async def on_handle(matcher: Matcher, event: Event):
-    arg = parse_arg(event.get_plaintext())
+@command("bl", aliases={"blacklist", "blocked"}, args=[Arg("arg", many=True)])
+async def on_handle(matcher: Matcher, event: Event, arg: list[str]):
     if len(arg) == 1:
         match arg[0]:
             case "add":
-                await matcher.finish("[BlackList] 添加黑名单 -> /bl add <uid> [reason]")
+                await matcher.finish("[BlackList] 添加黑名单 -> /bl add <uid> [duration] [reason]\n"
+                                     "duration示例: 30 (分钟), 30m, 12h, 7d, 不填或为0时永久")
             case "remove":
                 await matcher.finish("[BlackList] 移除黑名单 -> /bl remove <uid>")
             case "get":
                 await matcher.finish("[BlackList] 查询黑名单[不需要管理员权限] -> /bl get <uid>")
+            case "history":
+                await matcher.finish("[BlackList] 查询黑名单历史 -> /bl history <uid>")
     elif len(arg) == 2 and arg[0] == "get":
         uid = arg[1]
         if black_list.in_black_list(uid):
+            entry = black_list.get_user(uid)
+            expire = entry.get("expire")
             await matcher.finish(
-                f"[BlackList] 黑名单查询结果\nUID: {uid}\nREASON: {black_list.get_user(uid)['reason']}")
+                f"[BlackList] 黑名单查询结果\nUID: {uid}\nREASON: {entry['reason']}\n"
+                f"EXPIRE: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(expire)) if expire else '永久'}")
         else:
             await matcher.finish(f"[BlackList] {uid} 不在黑名单内")
     elif len(arg) >= 2:
@@ -235,10 +1729,20 @@ async def on_handle(matcher: Matcher, event: Event):
             case "add":
                 uid = arg[1]
                 reason: str = "idk"
-                if len(arg) >= 3:
-                    reason = " ".join(arg[2:])
+                # 和 /invite 一样, 纯数字按分钟计算; 无法解析为时长的参数作为原因
+                duration = parse_duration(arg[2]) if len(arg) >= 3 else None
+                reason_start = 2 if duration is None else 3
+                if len(arg) > reason_start:
+                    reason = " ".join(arg[reason_start:])
                 in_type = black_list.in_black_list(uid)
-                black_list.add_user(uid, reason)
+                expire = time.time() + duration if duration else None
+                black_list.add_user(uid, reason, expire)
+                if expire is not None:
+                    scheduler.schedule(f"blacklist-expire:{uid}", expire, "blacklist-expire", {"uid": uid})
+                else:
+                    scheduler.cancel(f"blacklist-expire:{uid}")
+                audit_log.write("blacklist-add", uid=uid, operator=event.get_user_id(), reason=reason,
+                                duration=duration)
                 await matcher.finish(
                     f"[BlackList] 成功{('修改 ' + uid + ' 的封禁原因') if in_type else ('添加 ' + uid + ' 到黑名单中')}")
             case "remove":
@@ -246,67 +1750,272 @@ async def on_handle(matcher: Matcher, event: Event):
                 if not black_list.in_black_list(uid):
                     await matcher.finish(f"[BlackList] UID{uid} 不存在于黑名单中")
                 black_list.remove_user(uid)
+                scheduler.cancel(f"blacklist-expire:{uid}")
+                audit_log.write("blacklist-remove", uid=uid, operator=event.get_user_id())
                 await matcher.finish(f"[BlackList] 成功解除{uid}的封禁")
+            case "history":
+                entries = await audit_log.search(uid=arg[1], actions=("blacklist-add", "blacklist-remove"))
+                if not entries:
+                    await matcher.finish(f"[BlackList] {arg[1]} 没有黑名单记录")
+                await matcher.finish(f"[BlackList] {arg[1]} 的黑名单记录\n" +
+                                     "\n".join(map(format_audit_entry, entries)))
     else:
-        await matcher.finish("[BlackList] 错误的使用方法 -> /bl add|remove|get [sub-args]")
+        await matcher.finish("[BlackList] 错误的使用方法 -> /bl add|remove|get|history [sub-args]")
+
+
+async def on_blacklist_expire(args: dict):
+    uid = args["uid"]
+    entry = black_list.config["black-list"].get(uid)
+    if entry is not None and entry.get("expire") is not None and entry["expire"] <= time.time():
+        black_list.remove_user(uid)
+        audit_log.write("blacklist-expire", uid=uid)
+
+
+scheduler.register("blacklist-expire", on_blacklist_expire)
 
 
 # Module AutoAccept start
 
-@on_request().handle()
+@on_request(handlers=[trace_matcher]).handle()
 async def on_handle(bot: Bot, matcher: Matcher, event: FriendRequestEvent):
     if not utils.get_state("auto-accept"):
         return
     raw: dict = json.loads(event.json())
     flag = raw["flag"]
     uid = event.get_user_id()
-    await bot.set_friend_add_request(flag=flag, approve=not black_list.in_black_list(uid))
+    await executor.call(bot, "set_friend_add_request", flag=flag, approve=not black_list.in_black_list(uid))
 
 
-@on_request().handle()
+@on_request(handlers=[trace_matcher]).handle()
 async def on_handle(bot: Bot, event: GroupRequestEvent):
     if not utils.get_state("auto-accept"):
         return
     group: str = str(event.group_id)
     user: str = event.get_user_id()
     raw: dict = json.loads(event.json())
-    comment: str = raw["comment"]
     flag = raw["flag"]
     sub_type: str = raw["sub_type"]
-    is_invite = "invitor_id" in raw
 
     if sub_type == "invite":
-        await bot.set_group_add_request(flag=flag, sub_type=sub_type, approve=(user in utils.get_admins()),
-                                        reason="你不可以邀请")
+        await executor.call(bot, "set_group_add_request", flag=flag, sub_type=sub_type,
+                            approve=(user in utils.get_admins()), reason="你不可以邀请")
         if user not in utils.get_admins():
             await bot.send_private_msg(user_id=int(user),
                                        message="你尝试邀请机器人, 但是你不是管理员")
     elif sub_type == "add":
-        if black_list.in_black_list(user) or (is_invite and black_list.in_black_list(str(raw["invitor_id"]))):
-            await bot.set_group_add_request(flag=flag, sub_type=sub_type, approve=False, reason="QQ存在黑名单中")
-        elif get_accept_type(group) == "accept":
-            await bot.set_group_add_request(flag=flag, sub_type=sub_type, approve=True, reason="Accepted")
-        elif get_accept_type(group) == "reject":
-            await bot.set_group_add_request(flag=flag, sub_type=sub_type, approve=False, reason="禁止所有人加入")
-        elif get_accept_type(group) == "include":
-            target_text = get_group(group)["target"]
-            await bot.set_group_add_request(flag=flag, sub_type=sub_type, approve=target_text in comment,
-                                            reason="加群消息不包含目标文字")
-        elif get_accept_type(group) == "invite-code":
-            await bot.set_group_add_request(flag=flag, sub_type=sub_type,
-                                            approve=use_activate_code(comment, group),
-                                            reason="邀请码错误")
-
-
-def use_activate_code(code: str, group: str) -> bool:
-    """Use the action code"""
-    activate_codes: list = utils.init_value("auto-accept", "groups")[group]["activate-codes"]
-    for key in activate_codes:
-        if key in code:
-            activate_codes.remove(key)
-            utils.set_value("auto-accept", "activate-codes", activate_codes)
-            return True  # OK
-    return False  # Code not found
+        if utils.get_state("anti-raid") and anti_raid.on_request(bot, group, raw):
+            return  # 防护模式下排队处理
+        decision = decide_group_request(group, raw)
+        if decision is not None:
+            audit_log.write("join-request", uid=user, gid=group, approve=decision[0], reason=decision[1])
+            await executor.call(bot, "set_group_add_request", flag=flag, sub_type=sub_type, approve=decision[0],
+                                reason=decision[1])
+
+
+def decide_group_request(group: str, raw: dict) -> tuple[bool, str] | None:
+    """按群的自动审核规则决定是否同意加群请求, 返回 (approve, reason), 没有规则时返回None"""
+    user = str(raw["user_id"])
+    comment: str = raw["comment"]
+    if black_list.in_black_list(user) or ("invitor_id" in raw and black_list.in_black_list(str(raw["invitor_id"]))):
+        return False, "QQ存在黑名单中"
+    accept_type = get_accept_type(group)
+    if accept_type == "accept":
+        return True, "Accepted"
+    elif accept_type == "reject":
+        return False, "禁止所有人加入"
+    elif accept_type == "include":
+        return get_group(group)["target"] in comment, "加群消息不包含目标文字"
+    elif accept_type == "invite-code":
+        return invite_codes.use(group, comment), "邀请码错误"
+    return None
+
+
+class InviteCodes(object):
+    """加群邀请码
+
+    邀请码只保存sha256, 每个群一个 hash -> 条目 的字典, 查询为O(1);
+    条目包含剩余次数和过期时间, 消耗时检查和扣减之间没有await, 共享存储模式下使用事务"""
+
+    alphabet = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"  # 去掉了容易看错的字符
+
+    def __init__(self, store: SharedStore | None = None):
+        object.__init__(self)
+        self.store = store
+        self.codes: dict[str, dict[str, dict]] = {}  # gid -> code hash -> {"uses", "expire", "add-date"}
+        self.stats: dict[str, dict[str, int]] = {}  # gid -> {"accepted": n, "rejected": n}
+        self.codes_json = os.path.join(utils.config_dir, "invite-codes.json")
+        self.load()
+
+    def load(self):
+        if self.store is not None:
+            self.store.subscribe("invite-codes", self.on_store_change)
+            self.store.subscribe("invite-stats", self.on_stats_change)
+            for key, entry in self.store.load("invite-codes").items():
+                self.on_store_change(key, entry)
+            self.stats = self.store.load("invite-stats")
+            return
+        if os.path.isfile(self.codes_json):
+            with open(self.codes_json, "r", encoding="UTF-8") as f:
+                data: dict = json.load(f)
+            self.codes = data["codes"]
+            self.stats = data["stats"]
+
+    def save(self):
+        if self.store is not None:
+            return  # 共享存储模式下每个条目单独写入
+        with open(self.codes_json, "w", encoding="utf-8") as f:
+            json.dump({"codes": self.codes, "stats": self.stats}, f, indent=4, ensure_ascii=False)
+
+    def on_store_change(self, key: str, entry: dict | None):
+        gid, code_hash = key.split("/", 1)
+        if entry is None:
+            self.codes.get(gid, {}).pop(code_hash, None)
+        else:
+            self.codes.setdefault(gid, {})[code_hash] = entry
+
+    def on_stats_change(self, gid: str, stats: dict | None):
+        self.stats[gid] = stats or {}
+
+    @staticmethod
+    def hash_code(code: str) -> str:
+        return hashlib.sha256(code.strip().upper().encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def candidates(comment: str) -> list[str]:
+        """从加群验证消息中提取可能是邀请码的部分"""
+        found = [comment, re.split("答案[：:]", comment)[-1]]
+        found += re.findall(r"[0-9A-Za-z_-]{4,}", comment)
+        return list(dict.fromkeys(code.strip() for code in found if code.strip()))
+
+    def add(self, gid: str, codes: list[str], uses: int = 1, expire: float | None = None):
+        entries = {self.hash_code(code): {"uses": uses, "expire": expire, "add-date": time.time()} for code in codes}
+        self.codes.setdefault(gid, {}).update(entries)
+        if self.store is not None:
+            self.store.put_many("invite-codes", {f"{gid}/{code_hash}": entry for code_hash, entry in entries.items()})
+        self.save()
+
+    def generate(self, gid: str, count: int, uses: int = 1, expire: float | None = None) -> list[str]:
+        codes: set[str] = set()
+        group = self.codes.get(gid, {})
+        while len(codes) < count:
+            code = "".join(secrets.choice(self.alphabet) for _ in range(10))
+            if self.hash_code(code) not in group:
+                codes.add(code)
+        self.add(gid, list(codes), uses, expire)
+        return list(codes)
+
+    def clear(self, gid: str) -> int:
+        group = self.codes.pop(gid, {})
+        if self.store is not None:
+            self.store.put_many("invite-codes", {f"{gid}/{code_hash}": None for code_hash in group})
+        self.save()
+        return len(group)
+
+    def use(self, gid: str, comment: str) -> bool:
+        """使用验证消息中的邀请码, 成功时扣减一次次数"""
+        group = self.codes.get(gid, {})
+        for code in self.candidates(comment):
+            code_hash = self.hash_code(code)
+            if code_hash in group and self.consume(gid, code_hash):
+                self.count(gid, "accepted")
+                return True
+        self.count(gid, "rejected")
+        return False
+
+    def consume(self, gid: str, code_hash: str) -> bool:
+        now = time.time()
+        consumed = False
+
+        def take(entry: dict | None) -> dict | None:
+            nonlocal consumed
+            if entry is None or (entry["expire"] is not None and entry["expire"] < now):
+                return None  # 不存在或已过期, 顺便删除
+            consumed = True
+            entry = dict(entry, uses=entry["uses"] - 1)
+            return entry if entry["uses"] > 0 else None
+
+        if self.store is not None:
+            entry = self.store.update("invite-codes", f"{gid}/{code_hash}", take)
+        else:
+            entry = take(self.codes[gid].get(code_hash))
+        self.on_store_change(f"{gid}/{code_hash}", entry)
+        self.save()
+        return consumed
+
+    def count(self, gid: str, key: str):
+        def increase(stats: dict | None) -> dict:
+            stats = dict(stats or {})
+            stats[key] = stats.get(key, 0) + 1
+            return stats
+
+        if self.store is not None:
+            self.stats[gid] = self.store.update("invite-stats", gid, increase)
+        else:
+            self.stats[gid] = increase(self.stats.get(gid))
+            self.save()
+
+    def get_stats(self, gid: str) -> dict:
+        now = time.time()
+        entries = list(self.codes.get(gid, {}).values())
+        active = [entry for entry in entries if entry["expire"] is None or entry["expire"] >= now]
+        return {
+            "active": len(active),
+            "expired": len(entries) - len(active),
+            "remaining-uses": sum(entry["uses"] for entry in active),
+            "accepted": self.stats.get(gid, {}).get("accepted", 0),
+            "rejected": self.stats.get(gid, {}).get("rejected", 0)
+        }
+
+
+@command("invite", aliases={"invitecode"}, admin=True, args=[Arg("arg", many=True)])
+async def on_handle(matcher: Matcher, bot: Bot, event: Event, arg: list[str]):
+    usage = ("[InviteCode] 邀请码管理\n"
+             "生成 -> /invite gen <gid> <count> [uses] [expire]\n"
+             "添加 -> /invite add <gid> <code> [uses] [expire]\n"
+             "清空 -> /invite clear <gid>\n"
+             "统计 -> /invite stats <gid>\n"
+             "expire示例: 30 (分钟), 12h, 7d")
+    if len(arg) >= 3 and arg[0] in ("gen", "add"):
+        gid = arg[1]
+        try:
+            uses = int(arg[3]) if len(arg) >= 4 else 1
+            count = int(arg[2]) if arg[0] == "gen" else 1
+        except ValueError:
+            await matcher.finish(usage)
+        duration = parse_duration(arg[4]) if len(arg) >= 5 else None
+        if (len(arg) >= 5 and duration is None) or uses < 1 or not 0 < count <= 10000:
+            await matcher.finish(usage)
+        expire = time.time() + duration if duration is not None else None
+        if arg[0] == "add":
+            invite_codes.add(gid, [arg[2]], uses, expire)
+            await matcher.finish(f"[InviteCode] 已为群{gid}添加邀请码")
+        codes = invite_codes.generate(gid, count, uses, expire)
+        if len(codes) <= 20:
+            await matcher.finish(f"[InviteCode] 已为群{gid}生成{len(codes)}个邀请码\n" + "\n".join(codes))
+        codes_dir = os.path.join(utils.config_dir, "invite-codes")
+        os.makedirs(codes_dir, exist_ok=True)
+        name = f"{gid}-{int(time.time())}.txt"
+        path = os.path.join(codes_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(codes))
+        try:
+            if isinstance(event, GroupMessageEvent):
+                await bot.upload_group_file(group_id=event.group_id, file=path, name=name)
+            else:
+                await bot.upload_private_file(user_id=int(event.get_user_id()), file=path, name=name)
+        except ActionFailed:
+            await matcher.finish(f"[InviteCode] 已为群{gid}生成{len(codes)}个邀请码, 上传文件失败, 请在 {path} 查看")
+        await matcher.finish(f"[InviteCode] 已为群{gid}生成{len(codes)}个邀请码, 见文件 {name}")
+    elif len(arg) == 2 and arg[0] == "clear":
+        await matcher.finish(f"[InviteCode] 已删除群{arg[1]}的{invite_codes.clear(arg[1])}个邀请码")
+    elif len(arg) == 2 and arg[0] == "stats":
+        stats = invite_codes.get_stats(arg[1])
+        await matcher.finish(f"[InviteCode] 群{arg[1]}邀请码统计\n"
+                             f"可用邀请码: {stats['active']} (剩余{stats['remaining-uses']}次)\n"
+                             f"已过期: {stats['expired']}\n"
+                             f"通过: {stats['accepted']}\n"
+                             f"拒绝: {stats['rejected']}")
+    await matcher.finish(usage)
 
 
 def get_group(group_id: str) -> dict | None:
@@ -322,13 +2031,141 @@ def get_accept_type(group_id: str) -> None | str:
 
 utils.init_module("auto-accept")
 utils.init_value("auto-accept", "groups", {})
+invite_codes = InviteCodes(store)
+for legacy_gid, legacy_group in utils.init_value("auto-accept", "groups").items():
+    if legacy_group.get("activate-codes"):  # 迁移旧版本保存在配置文件里的邀请码
+        invite_codes.add(legacy_gid, legacy_group.pop("activate-codes"))
+        utils.save()
 
 
 # Module AutoAccept end
 
+# Module AntiRaid start
+class AntiRaid(object):
+    """按群统计加群请求/入群的频率, 超过阈值时进入防护模式
+
+    防护模式下新的加群请求进入队列, 由后台任务按 batch-size / batch-interval 分批处理,
+    频率回落并持续 cooldown 秒后自动解除"""
+
+    def __init__(self):
+        object.__init__(self)
+        self.requests: dict[str, deque[float]] = {}
+        self.joins: dict[str, deque[float]] = {}
+        self.locked: dict[str, float] = {}  # gid -> 最后一次超过阈值的时间
+        self.queue: dict[str, deque[dict]] = {}  # gid -> 等待处理的加群请求
+        self.bots: dict[str, str] = {}  # gid -> 用于发送通知和处理请求的bot
+
+    @staticmethod
+    def hit(history: dict[str, deque[float]], gid: str, threshold: int) -> bool:
+        now = time.time()
+        window = utils.init_value("anti-raid", "window")
+        timestamps = history.setdefault(gid, deque())
+        timestamps.append(now)
+        while timestamps and timestamps[0] < now - window:
+            timestamps.popleft()
+        return len(timestamps) >= threshold
+
+    def trigger(self, bot: Bot, gid: str, exceeded: bool):
+        self.bots[gid] = bot.self_id
+        if not exceeded:
+            return
+        if gid not in self.locked:
+            run_background(self.notify(gid, "[AntiRaid] 检测到大量加群, 已开启防护模式, 加群请求将稍后处理"))
+        self.locked[gid] = time.time()
+
+    def in_lockdown(self, gid: str) -> bool:
+        if gid not in self.locked:
+            return False
+        if time.time() - self.locked[gid] < utils.init_value("anti-raid", "cooldown"):
+            return True
+        del self.locked[gid]
+        run_background(self.notify(gid, "[AntiRaid] 加群频率已恢复正常, 防护模式已解除"))
+        return False
+
+    def on_request(self, bot: Bot, gid: str, raw: dict) -> bool:
+        """记录加群请求, 需要排队时返回True"""
+        self.trigger(bot, gid, self.hit(self.requests, gid, utils.init_value("anti-raid", "request-threshold")))
+        if not self.in_lockdown(gid):
+            return False
+        queue = self.queue.setdefault(gid, deque())
+        if len(queue) >= utils.init_value("anti-raid", "max-queue"):
+            run_background(self.set_request(gid, raw, (False, "加群请求过多, 请稍后再试")))
+        else:
+            queue.append(raw)
+        return True
+
+    def on_join(self, bot: Bot, gid: str) -> bool:
+        """记录入群, 处于防护模式时返回True"""
+        self.trigger(bot, gid, self.hit(self.joins, gid, utils.init_value("anti-raid", "join-threshold")))
+        return self.in_lockdown(gid)
+
+    async def notify(self, gid: str, message: str):
+        bot = get_bots().get(self.bots.get(gid))
+        if bot is not None:
+            await executor.call(bot, "send_group_msg", group_id=int(gid), message=message)
+
+    async def set_request(self, gid: str, raw: dict, decision: tuple[bool, str]):
+        bot = get_bots().get(self.bots.get(gid))
+        if bot is None:
+            return
+        audit_log.write("join-request", uid=raw["user_id"], gid=gid, approve=decision[0], reason=decision[1])
+        await executor.call(bot, "set_group_add_request", flag=raw["flag"], sub_type=raw["sub_type"],
+                            approve=decision[0], reason=decision[1])
+
+    def decide(self, gid: str, raw: dict, locked: bool) -> tuple[bool, str] | None:
+        policy = utils.init_value("anti-raid", "policy")
+        if locked and policy == "reject":
+            return False, "加群请求过多, 请稍后再试"
+        if locked and policy == "invite-code":
+            if black_list.in_black_list(str(raw["user_id"])):
+                return False, "QQ存在黑名单中"
+            return invite_codes.use(gid, raw["comment"]), "防护模式下需要邀请码"
+        return decide_group_request(gid, raw)
+
+    async def process(self, gid: str):
+        locked = self.in_lockdown(gid)
+        queue = self.queue.get(gid)
+        if not queue or (locked and utils.init_value("anti-raid", "policy") == "hold"):
+            return
+        for _ in range(min(len(queue), utils.init_value("anti-raid", "batch-size"))):
+            raw = queue.popleft()
+            decision = self.decide(gid, raw, locked)
+            if decision is not None:
+                await self.set_request(gid, raw, decision)
+        if not queue:
+            del self.queue[gid]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(utils.init_value("anti-raid", "batch-interval"))
+            for gid in set(self.queue) | set(self.locked):
+                await self.process(gid)
+
+
+anti_raid = AntiRaid()
+
+
+@driver.on_startup
+async def on_startup_anti_raid():
+    run_background(anti_raid.run())
+
+
+utils.init_module("anti-raid")
+utils.init_value("anti-raid", "window", 60)  # 统计窗口(秒)
+utils.init_value("anti-raid", "request-threshold", 20)  # 窗口内加群请求数超过此值时开启防护
+utils.init_value("anti-raid", "join-threshold", 20)  # 窗口内入群人数超过此值时开启防护
+utils.init_value("anti-raid", "cooldown", 300)  # 频率回落后多久解除防护(秒)
+utils.init_value("anti-raid", "policy", "hold")  # hold: 解除后再审核 | reject: 全部拒绝 | invite-code: 只接受邀请码
+utils.init_value("anti-raid", "batch-size", 5)  # 每批处理的请求数
+utils.init_value("anti-raid", "batch-interval", 10)  # 每批之间的间隔(秒)
+utils.init_value("anti-raid", "max-queue", 500)  # 队列上限, 超过时直接拒绝
+
+
+# Module AntiRaid end
+
 # Module AutoWelcome
 
-@on_notice().handle()
+@on_notice(handlers=[trace_matcher]).handle()
 async def on_handle_join(bot: Bot, matcher: Matcher, event: GroupIncreaseNoticeEvent):
     if not check("auto-welcome", event):
         return
@@ -339,45 +2176,274 @@ async def on_handle_join(bot: Bot, matcher: Matcher, event: GroupIncreaseNoticeE
     if event.get_user_id() == bot.self_id:
         await matcher.finish(
             f"[AutoWelcome] 我是{BOT_NAME}, 我可以替代Q群管家, 如果你要获得更好的群聊体验, 请把我设置成管理员并删除Q群管家")
+    raid = utils.get_state("anti-raid") and anti_raid.on_join(bot, gid)
     if gid not in groups:
         return
     if black_list.in_black_list(uid) and auto_kick:
-        await bot.set_group_kick(group_id=int(gid), user_id=int(uid), reject_add_request=False)
+        audit_log.write("kick", uid=uid, gid=gid, operator=bot.self_id, reason="黑名单自动踢出")
+        await executor.call(bot, "set_group_kick", key=(gid, uid), group_id=int(gid), user_id=int(uid),
+                            reject_add_request=False)
+        run_background(recent_messages.purge(int(gid), uid))  # 退群后重新加入的刷屏者
+    if raid:
+        return  # 防护模式下不发送欢迎消息
+    if not notice_digest.add(bot, gid, "joins", uid):
+        return  # 合并到稍后发送的汇总消息中
     message: str = groups[gid].replace("%name%", f"[CQ:at,qq={uid}] ")
     await matcher.finish(Message(message))
 
 
-@on_notice().handle()
+@on_notice(handlers=[trace_matcher]).handle()
 async def on_handle_left(bot: Bot, matcher: Matcher, event: GroupDecreaseNoticeEvent):
     if not check("auto-welcome", event):
         return
     leave_message: str = utils.init_value("auto-welcome", "leave-message")
     uid = event.get_user_id()
+    if not notice_digest.add(bot, str(event.group_id), "leaves", uid):
+        return
+
+    user_name = await get_user_name(bot, uid)
+    message = leave_message.replace("%name%", f"{user_name} ({uid})")
+    await matcher.finish(Message(message))
+
+
+class NoticeDigest(object):
+    """合并入群/退群通知
+
+    一个群在 digest-window 秒内的第一条通知立即发送, 之后的通知先缓存,
+    窗口结束时合并为一条消息发送, 所有退群用户名一次并发获取"""
 
-    user_name = await get_user_name(bot, uid)
-    message = leave_message.replace("%name%", f"{user_name} ({uid})")
-    await matcher.finish(Message(message))
+    def __init__(self):
+        object.__init__(self)
+        self.windows: dict[str, dict] = {}  # gid -> {"bot": self_id, "joins": [uid], "leaves": [uid]}
+
+    def add(self, bot: Bot, gid: str, kind: str, uid: str) -> bool:
+        """记录一条通知, 返回True表示应该立即单独发送"""
+        window = utils.init_value("auto-welcome", "digest-window")
+        if window <= 0:
+            return True
+        if gid not in self.windows:
+            self.windows[gid] = {"bot": bot.self_id, "joins": [], "leaves": []}
+            run_background(self.flush_later(gid, window))
+            return True
+        self.windows[gid][kind].append(uid)
+        return False
+
+    async def flush_later(self, gid: str, window: float):
+        await asyncio.sleep(window)
+        pending = self.windows.pop(gid)
+        bot = get_bots().get(pending["bot"])
+        if bot is None or not (pending["joins"] or pending["leaves"]):
+            return
+        lines = []
+        welcome: str | None = utils.init_value("auto-welcome", "groups").get(gid)
+        if pending["joins"] and welcome is not None:
+            lines.append(welcome.replace("%name%", "".join(f"[CQ:at,qq={uid}] " for uid in pending["joins"])))
+        if pending["leaves"]:
+            names = await get_user_names(bot, pending["leaves"])
+            leave_message: str = utils.init_value("auto-welcome", "leave-message")
+            lines.append(leave_message.replace("%name%", ", ".join(f"{name} ({uid})" for uid, name in names.items())))
+        if lines:
+            await executor.call(bot, "send_group_msg", group_id=int(gid), message=Message("\n".join(lines)))
 
 
+notice_digest = NoticeDigest()
+
 utils.init_module("auto-welcome")
 utils.init_value("auto-welcome", "auto-kick", True)
 utils.init_value("auto-welcome", "leave-message", "%name% left")
 utils.init_value("auto-welcome", "groups", {})
+utils.init_value("auto-welcome", "digest-window", 5)  # 合并通知的时间窗口(秒), 0为不合并
 
 
 # Module AutoWelcome end
 
 
+# Module ImageCache start
+class ImageCache(object):
+    """皮肤/披风图片的本地缓存
+
+    Mojang纹理以纹理hash为键, 其他图片以url的sha256为键, 总大小超过上限时按LRU淘汰"""
+
+    def __init__(self, cache_dir: str):
+        object.__init__(self)
+        self.cache_dir = cache_dir
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.entries: OrderedDict[str, int] = OrderedDict()  # key -> size, 最近使用的在末尾
+        self.size = 0
+        self.downloading = SingleFlight()
+        files = [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and not entry.name.endswith(".tmp")]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            self.entries[entry.name] = entry.stat().st_size
+            self.size += entry.stat().st_size
+
+    @staticmethod
+    def key_of(url: str) -> str:
+        match = re.search(r"textures\.minecraft\.net/texture/([0-9a-fA-F]+)", url)
+        if match:
+            return match.group(1).lower()
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def path_of(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key: str) -> str | None:
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        path = self.path_of(key)
+        try:
+            os.utime(path)  # 重启后仍能恢复LRU顺序
+        except FileNotFoundError:
+            self.size -= self.entries.pop(key)
+            return None
+        return path
+
+    def put(self, key: str, content: bytes) -> str:
+        path = self.path_of(key)
+        with open(path + ".tmp", "wb") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+        self.size += len(content) - self.entries.pop(key, 0)
+        self.entries[key] = len(content)
+        self.evict()
+        return path
+
+    def evict(self):
+        max_size = utils.init_value("image-cache", "max-size") * 1024 * 1024
+        while self.size > max_size and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.path_of(key))
+            except FileNotFoundError:
+                pass
+
+    async def fetch(self, url: str) -> str | None:
+        """获取图片的本地路径, 同一张图片同时只会下载一次"""
+        key = self.key_of(url)
+        path = self.lookup(key)
+        if path is not None:
+            return path
+        return await self.downloading.run(key, lambda: self.download(key, url))
+
+    async def download(self, key: str, url: str) -> str | None:
+        try:
+            r = await get(url, timeout=utils.init_value("image-cache", "timeout"), follow_redirects=True,
+                          cache=False)
+            return self.put(key, r.content) if r.status_code == 200 else None
+        except (httpx.HTTPError, httpx.InvalidURL, OSError):
+            return None
+
+    def prefetch(self, *urls: str | None):
+        """在后台并发下载图片"""
+        for url in urls:
+            if url and self.lookup(self.key_of(url)) is None and self.key_of(url) not in self.downloading:
+                run_background(self.fetch(url))
+
+
+def cq_local_image(path: str) -> str:
+    if utils.init_value("image-cache", "send-as") == "base64":
+        with open(path, "rb") as f:
+            return f"[CQ:image,file=base64://{base64.b64encode(f.read()).decode()}]"
+    return f"[CQ:image,file={Path(path).as_uri()}]"
+
+
+async def cq_image(url: str) -> str:
+    """生成图片CQ码, 启用缓存时发送本地文件"""
+    if utils.get_state("image-cache"):
+        path = await image_cache.fetch(url)
+        if path is not None:
+            return cq_local_image(path)
+    return f"[CQ:image,file={url},cache=0]"
+
+
+utils.init_module("image-cache")
+utils.init_value("image-cache", "max-size", 256)  # 缓存上限(MB)
+utils.init_value("image-cache", "send-as", "base64")  # base64 | file: 本地文件(需要和go-cqhttp在同一台机器)
+utils.init_value("image-cache", "timeout", 10)
+image_cache = ImageCache(os.path.join(utils.config_dir, "image-cache"))
+
+
+# Module ImageCache end
+
+
 # Module get Minecraft Username start
+class MojangResolver(object):
+    """合并短时间内的用户名查询, 通过Mojang批量接口每次最多查询10个用户名"""
+
+    bulk_api = "https://api.mojang.com/profiles/minecraft"
+    single_api = "https://api.mojang.com/users/profiles/minecraft/"
+    batch_size = 10
+
+    def __init__(self):
+        object.__init__(self)
+        self.pending: dict[str, list[asyncio.Future]] = {}  # 小写用户名 -> 等待结果的调用者
+        self.flush_handle: asyncio.TimerHandle | None = None
+
+    async def resolve(self, username: str) -> dict | None:
+        """查询用户名, 返回 {"id": uuid, "name": 用户名} 或 None"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.setdefault(username.lower(), []).append(future)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(utils.init_value("minecraft", "batch-window") / 1000, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        names = list(self.pending.items())
+        self.pending = {}
+        for i in range(0, len(names), self.batch_size):
+            run_background(self.lookup(dict(names[i:i + self.batch_size])))
+
+    async def lookup(self, batch: dict[str, list[asyncio.Future]]):
+        profiles = {}
+        try:
+            try:
+                r = await post(self.bulk_api, {}, json=list(batch))
+                if r.status_code != 200:
+                    raise httpx.HTTPStatusError("bulk lookup failed", request=r.request, response=r)
+                profiles = {profile["name"].lower(): self.check(profile) for profile in r.json()}
+            except (httpx.HTTPError, ValueError, KeyError, TypeError):
+                # 批量接口不可用或返回了错误的内容时逐个查询
+                profiles = {}
+                for name in batch:
+                    try:
+                        r = await get(self.single_api + name)
+                        if r.status_code == 200:
+                            profiles[name] = self.check(r.json())
+                    except (httpx.HTTPError, ValueError, KeyError, TypeError):
+                        pass
+        finally:
+            # 无论查询是否出错都要唤醒所有调用者
+            for name, futures in batch.items():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(profiles.get(name))
+
+    @staticmethod
+    def check(profile: Any) -> dict:
+        """确认返回的是带 id 和 name 的玩家资料"""
+        if not isinstance(profile["id"], str) or not isinstance(profile["name"], str):
+            raise TypeError(profile)
+        return profile
+
+
+mojang_resolver = MojangResolver()
+
+
 async def get_exact_minecraft_name(username: str) -> None | str:
     """获取有大小写的Minecraft用户名称"""
     if len(username) > 17:
         r = await get("https://sessionserver.mojang.com/session/minecraft/profile/" + username)
         return r.json()["name"]
-    r = await get("https://api.mojang.com/users/profiles/minecraft/" + username)
-    if r.status_code == 200:
-        return r.json()["name"]
-    return None
+    profile = await mojang_resolver.resolve(username)
+    return profile["name"] if profile is not None else None
 
 
 # Module get Minecraft Username end
@@ -385,7 +2451,7 @@ async def get_exact_minecraft_name(username: str) -> None | str:
 
 # Module OF cape start
 async def get_of_cape(username: str, proxy="http://s.optifine.net/capes") -> dict:
-    username = await get_exact_minecraft_name(username)
+    """username需要是大小写正确的用户名"""
     cape_image = proxy + "/{}.png".format(username)
     r = await get(cape_image)
     if r.status_code != 200:
@@ -401,37 +2467,31 @@ async def get_of_cape(username: str, proxy="http://s.optifine.net/capes") -> dic
     return {"state": True, "cape": cape_url, "image": cape_image, "username": username}
 
 
-@on_command("ofcape").handle()
-async def on_handle(matcher: Matcher, event: Event):
-    if not utils.get_state("ofcape"):
-        return
-    arg = parse_arg(event.get_plaintext())
-    if len(arg) == 0:
-        await matcher.finish("[OF Cape] 获取玩家OF披风 -> /ofcape <playerUuid|playerUserName> [proxy]")
-    elif len(arg) == 1:
-        username = arg[0]
-        real_username: str = await get_exact_minecraft_name(username)
+@command("ofcape", module="ofcape", args=[Arg("player"), Arg("proxy", default=None)], limit="optifine",
+         usage="[OF Cape] 获取玩家OF披风 -> /ofcape <playerUuid|playerUserName> [proxy]")
+async def on_handle(matcher: Matcher, player: str, proxy: str | None):
+    real_username: str = await get_exact_minecraft_name(player)
+    if real_username is None:
+        await matcher.finish(f"[OF Cape] 玩家{player}不存在")
+    elif proxy is None:
         of = await get_of_cape(real_username)
         if of["state"]:
             await matcher.finish(
                 Message(
-                    "[OF Cape] Cape of {}\nURL: {}\n[CQ:image,file={},cache=0]".format(of["username"], of["cape"] if of[
-                        "cape"] else "Default cape", of["image"])))
+                    "[OF Cape] Cape of {}\nURL: {}\n{}".format(of["username"], of["cape"] if of[
+                        "cape"] else "Default cape", await cq_image(of["image"]))))
         else:
             await matcher.finish("[OF Cape] 玩家{}没有披风".format(of["username"]))
-    elif len(arg) == 2:
-        username = arg[0]
-        proxy = arg[1]
-        real_username: str = await get_exact_minecraft_name(username)
+    else:
         of = await get_of_cape(real_username, proxy)
         if of["state"]:
             await matcher.finish(
-                Message("[OF Cape] Cape of {}\nURL: {} (On proxy server: {})\n[CQ:image,file={}]".format(of["username"],
-                                                                                                         of["cape"] if
-                                                                                                         of[
-                                                                                                             "cape"] else "Default cape",
-                                                                                                         proxy,
-                                                                                                         of["image"])))
+                Message("[OF Cape] Cape of {}\nURL: {} (On proxy server: {})\n{}".format(of["username"],
+                                                                                         of["cape"] if
+                                                                                         of[
+                                                                                             "cape"] else "Default cape",
+                                                                                         proxy,
+                                                                                         await cq_image(of["image"]))))
         else:
             await matcher.finish("[OF Cape] 玩家{}没有披风\nUse proxy: {}".format(of["username"], proxy))
 
@@ -442,35 +2502,43 @@ utils.init_module("ofcape")
 # Module OF cape end
 
 # Module Mojang cape start
+async def get_capes_dev(username: str) -> dict:
+    """查询capes.dev, 返回 {披风类型: {"still": 展开图, "front": 正面图}}, 只包含存在的披风"""
+    r = await get("https://api.capes.dev/load/" + username)
+    capes = {}
+    for cape_type, cape in r.json().items():
+        if not isinstance(cape, dict) or not cape.get("exists", cape.get("msg") != "Player has no cape"):
+            continue
+        capes[cape_type] = {"still": cape["stillImageUrl"] + ".png" if cape.get("stillImageUrl") else None,
+                            "front": cape["frontImageUrl"] + ".png" if cape.get("frontImageUrl") else None}
+    return capes
+
+
 async def get_mojang_cape(username: str) -> dict:
-    username = await get_exact_minecraft_name(username)
-    mojang_cape_url = await get("https://api.capes.dev/load/" + username)
-    checker = mojang_cape_url.json()['minecraft']['msg']
-    if checker == "Player has no cape":
+    exact_name = await get_exact_minecraft_name(username)
+    if exact_name is None:
+        return {"state": False, "exists": False, "username": username}
+    username = exact_name
+    capes = await get_capes_dev(username)
+    if "minecraft" not in capes:
         return {"state": False, "username": username}
-    else:
-        mojang_cape_still = mojang_cape_url.json()['minecraft']['stillImageUrl'] + ".png"
-        mojang_cape_front = mojang_cape_url.json()['minecraft']['frontImageUrl'] + ".png"
-        return {"state": True, "image_still": mojang_cape_still, "image_front": mojang_cape_front, "username": username}
+    return {"state": True, "image_still": capes["minecraft"]["still"], "image_front": capes["minecraft"]["front"],
+            "username": username}
 
 
-@on_command("mojangcape").handle()
-async def on_handle(matcher: Matcher, event: Event):
-    if not utils.get_state("mojangcape"):
-        return
-    arg = parse_arg(event.get_plaintext())
-    if len(arg) == 1:
-        username = arg[0]
-        mojang = await get_mojang_cape(username)
-        if mojang["state"]:
-            await matcher.finish(
-                Message(
-                    "[Mojang Cape] Cape of {}\n展开图：[CQ:image,file={},cache=0]正面图：[CQ:image,file={},cache=0]".format(
-                        mojang["username"], mojang["image_still"], mojang["image_front"])))
-        else:
-            await matcher.finish("[Mojang Cape] 玩家{}没有披风".format(mojang["username"]))
+@command("mojangcape", module="mojangcape", args=[Arg("username")], limit="mojang",
+         usage="[Mojang Cape] 格式错误\n输入格式 -> /mojangcape <playerUuid|playerUserName>")
+async def on_handle(matcher: Matcher, username: str):
+    mojang = await get_mojang_cape(username)
+    if mojang["state"]:
+        still, front = await asyncio.gather(cq_image(mojang["image_still"]), cq_image(mojang["image_front"]))
+        await matcher.finish(
+            Message(
+                "[Mojang Cape] Cape of {}\n展开图：{}正面图：{}".format(mojang["username"], still, front)))
+    elif not mojang.get("exists", True):
+        await matcher.finish(f"[Mojang Cape] 玩家{username}不存在")
     else:
-        await matcher.finish("[Mojang Cape] 格式错误\n输入格式 -> /mojangcape <playerUuid|playerUserName>")
+        await matcher.finish("[Mojang Cape] 玩家{}没有披风".format(mojang["username"]))
 
 
 utils.init_module("mojangcape")
@@ -479,8 +2547,289 @@ utils.init_module("mojangcape")
 # Module Mojang cape end
 
 
+# Module Cape start
+async def cape_from_mojang(info: dict) -> str:
+    if info["cape"] is None:
+        return "没有披风"
+    return f"{info['cape']}\n{await cq_image(info['cape'])}"
+
+
+async def cape_from_optifine(info: dict) -> str:
+    of = await get_of_cape(info["username"])
+    if not of["state"]:
+        return "没有披风"
+    return f"{of['cape'] if of['cape'] else 'Default cape'}\n{await cq_image(of['image'])}"
+
+
+async def cape_from_capes_dev(info: dict) -> str:
+    capes = await get_capes_dev(info["username"])
+    capes.pop("minecraft", None)  # 已经由Mojang查询
+    capes.pop("optifine", None)
+    if not capes:
+        return "没有其他披风"
+    images = await asyncio.gather(*(cq_image(cape["front"] or cape["still"]) for cape in capes.values()
+                                    if cape["front"] or cape["still"]))
+    return ", ".join(capes) + "\n" + "".join(images)
+
+
+cape_sources = {
+    "Mojang": cape_from_mojang,
+    "OptiFine": cape_from_optifine,
+    "capes.dev": cape_from_capes_dev
+}
+
+
+@command("cape", module="cape", args=[Arg("player")], limit="mojang",
+         usage="[Cape] 查询玩家所有披风 -> /cape <playerUuid|playerUserName>")
+async def on_handle(matcher: Matcher, player: str):
+    """同时查询所有来源的披风"""
+    try:
+        info = await get_player_info(player)
+    except (KeyError, ValueError, httpx.HTTPError):
+        info = None
+    if info is None:
+        await matcher.finish(f"[Cape] 玩家{player}不存在")
+    timeout = utils.init_value("cape", "timeout")
+    tasks = {name: asyncio.create_task(asyncio.wait_for(source(info), timeout))
+             for name, source in cape_sources.items()}
+    await asyncio.wait(tasks.values(), timeout=utils.init_value("cape", "budget"))
+    msg = f"[Cape] Capes of {info['username']}"
+    for name, task in tasks.items():
+        if not task.done():
+            task.cancel()
+            result = "查询超时"
+        elif task.exception() is not None:
+            result = "查询超时" if isinstance(task.exception(), asyncio.TimeoutError) else "查询失败"
+        else:
+            result = task.result()
+        msg += f"\n{name}: {result}"
+    await matcher.finish(Message(msg))
+
+
+utils.init_module("cape")
+utils.init_value("cape", "timeout", 4)  # 单个来源的超时时间(秒)
+utils.init_value("cape", "budget", 6)  # 整条指令最多等待的时间(秒)
+
+
+# Module Cape end
+
+
 # Module AutoMute start
-@on_message().handle()
+# 常见的拉丁字母形近字(西里尔/希腊字母), 在casefold之后替换
+CONFUSABLES = {
+    "а": "a", "в": "b", "е": "e", "ё": "e", "к": "k", "м": "m", "н": "h", "о": "o", "р": "p", "с": "c", "т": "t",
+    "у": "y", "х": "x", "ѕ": "s", "і": "i", "ї": "i", "ј": "j", "ԁ": "d", "ԛ": "q", "ԝ": "w", "ɡ": "g", "ı": "i",
+    "α": "a", "β": "b", "ε": "e", "η": "n", "ι": "i", "κ": "k", "ν": "v", "ο": "o", "ρ": "p", "τ": "t", "υ": "u",
+    "χ": "x", "ω": "w"
+}
+# 不属于Cf类别但显示为空白的填充字符
+FILLER_CHARS = "\u115f\u1160\u3164\uffa0\u034f\u2800"
+
+
+def build_normalize_table() -> dict[int, str | None]:
+    """形近字替换为对应字母, 零宽/格式控制字符(Cf)删除"""
+    table: dict[int, str | None] = {ord(char): replacement for char, replacement in CONFUSABLES.items()}
+    for code in itertools.chain(range(0x10000), range(0xE0000, 0xE0080)):
+        if unicodedata.category(chr(code)) == "Cf":
+            table[code] = None
+    table.update({ord(char): None for char in FILLER_CHARS})
+    return table
+
+
+NORMALIZE_TABLE = build_normalize_table()
+
+
+def normalize_text(text: str) -> str:
+    """全角/兼容字符折叠(NFKC), 忽略大小写, 替换形近字并去掉不可见字符"""
+    return unicodedata.normalize("NFKC", text).casefold().translate(NORMALIZE_TABLE)
+
+
+class MuteRules(object):
+    """预处理后的auto-mute规则
+
+    屏蔽词在加载时同样经过 normalize_text, 合并成一个正则; 完全匹配的词放进 frozenset.
+    配置修改后(utils.revision 变化)在下一条消息时重新编译"""
+
+    def __init__(self):
+        object.__init__(self)
+        self.revision = -1
+        self.words: re.Pattern | None = None
+        self.patterns: list[re.Pattern] = []
+        self.full_match: frozenset[str] = frozenset()
+
+    def get(self) -> "MuteRules":
+        if self.revision != utils.revision:
+            self.compile()
+        return self
+
+    def compile(self):
+        self.revision = utils.revision
+        words = {normalize_text(word) for word in utils.init_value("auto-mute", "blocked-words", [])}
+        words.discard("")
+        # 长的词放在前面, 避免被前缀更短的词提前匹配
+        self.words = re.compile("|".join(map(re.escape, sorted(words, key=len, reverse=True)))) if words else None
+        self.patterns = []
+        for pattern in utils.init_value("auto-mute", "blocked-pattern", []):
+            try:
+                self.patterns.append(re.compile(pattern))
+            except re.error:
+                traceback.print_exc()
+        self.full_match = frozenset(normalize_text(word)
+                                    for word in utils.init_value("auto-mute", "blocked-words-full-match", []))
+
+    def blocked(self, msg: str) -> bool:
+        text = normalize_text(msg)
+        if self.words is not None and len(msg) > utils.init_value("auto-mute", "bypass-long") \
+                and self.words.search(text):
+            return True
+        if any(pattern.match(msg) or pattern.match(text) for pattern in self.patterns):
+            return True
+        return text in self.full_match
+
+
+mute_rules = MuteRules()
+
+
+def dhash(content: bytes) -> int:
+    """图片的差异哈希(dHash): 缩放成9x8灰度图, 比较每行相邻像素的亮度, 得到64位整数"""
+    with Image.open(io.BytesIO(content)) as image:
+        image.seek(0)  # 动图只取第一帧
+        pixels = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+class BKTree(object):
+    """以汉明距离为度量的BK树, 查找与给定哈希距离不超过阈值的所有哈希"""
+
+    def __init__(self, values: Iterable[int] = ()):
+        object.__init__(self)
+        self.root: tuple[int, dict] | None = None  # (hash, {距离: 子节点})
+        self.size = 0
+        for value in values:
+            self.add(value)
+
+    def add(self, value: int):
+        if self.root is None:
+            self.root = (value, {})
+            self.size += 1
+            return
+        node = self.root
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (value, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value: int, threshold: int) -> list[tuple[int, int]]:
+        """返回 (距离, 哈希) 列表, 按距离从小到大"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ value).bit_count()
+            if distance <= threshold:
+                found.append((distance, node[0]))
+            # 三角不等式: 只有到当前节点距离在 [d-t, d+t] 内的子树可能匹配
+            stack.extend(child for d, child in node[1].items() if distance - threshold <= d <= distance + threshold)
+        return sorted(found)
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class ImageHashes(object):
+    """图片感知哈希和违禁图片索引
+
+    违禁图片的哈希(16位十六进制)保存在 auto-mute.banned-images, 配置变化后重建BK树.
+    图片按 file 字段缓存哈希, 同一张图片重复发送时不再下载; 下载并发和大小都有上限"""
+
+    def __init__(self):
+        object.__init__(self)
+        self.revision = -1
+        self.tree = BKTree()
+        self.hashes = TTLCache(8192, 86400)  # file -> hash, 下载或解码失败时为 None
+        self.pending = SingleFlight()
+        self.semaphore: asyncio.Semaphore | None = None
+
+    def get(self) -> "ImageHashes":
+        if self.revision != utils.revision:
+            self.revision = utils.revision
+            self.tree = BKTree(int(value, 16) for value in utils.init_value("auto-mute", "banned-images", []))
+        return self
+
+    async def hash_of(self, segment: MessageSegment) -> int | None:
+        key = segment.data.get("file") or segment.data.get("url")
+        url = segment.data.get("url") or segment.data.get("file")
+        if not key or not url or not url.startswith(("http://", "https://")):
+            return None
+        if key in self.hashes:
+            return self.hashes.get(key)
+        return await self.pending.run(key, lambda: self.compute(key, url))
+
+    async def compute(self, key: str, url: str) -> int | None:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(utils.init_value("auto-mute", "image-concurrency"))
+        async with self.semaphore:
+            content = await self.download(url)
+        value = None
+        if content is not None:
+            try:
+                value = await asyncio.to_thread(dhash, content)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                value = None
+        self.hashes.set(key, value)
+        return value
+
+    @staticmethod
+    async def download(url: str) -> bytes | None:
+        """下载图片, 超过 image-max-size(KB) 时放弃"""
+        max_size = utils.init_value("auto-mute", "image-max-size") * 1024
+        with tracer.span("HTTP GET", **{"http.method": "GET", "http.url": url}) as span:
+            try:
+                async with httpx.AsyncClient(timeout=utils.init_value("auto-mute", "image-timeout")) as client:
+                    async with client.stream("GET", url, follow_redirects=True) as r:
+                        if span is not None:
+                            span.set("http.status_code", r.status_code)
+                        if r.status_code != 200 or int(r.headers.get("content-length") or 0) > max_size:
+                            return None
+                        content = bytearray()
+                        async for chunk in r.aiter_bytes():
+                            content += chunk
+                            if len(content) > max_size:
+                                return None
+                        return bytes(content)
+            except httpx.HTTPError:
+                return None
+
+    async def hashes_of(self, message: Message) -> list[int]:
+        images = [segment for segment in message if segment.type == "image"]
+        return [value for value in await asyncio.gather(*map(self.hash_of, images)) if value is not None]
+
+    async def banned(self, message: Message) -> int | None:
+        """消息中的图片与违禁图片足够相似时返回匹配的违禁哈希"""
+        if Image is None or not len(self.get().tree) or not any(s.type == "image" for s in message):
+            return None
+        threshold = utils.init_value("auto-mute", "image-threshold")
+        for value in await self.hashes_of(message):
+            found = self.tree.search(value, threshold)
+            if found:
+                return found[0][1]
+        return None
+
+
+image_hashes = ImageHashes()
+
+
+@on_message(handlers=[trace_matcher]).handle()
 async def on_handle(bot: Bot, event: GroupMessageEvent):
     uid = event.get_user_id()
     gid = event.group_id
@@ -489,51 +2838,69 @@ async def on_handle(bot: Bot, event: GroupMessageEvent):
     if uid in utils.get_admins() + utils.init_value("auto-mute", "white-list") or not utils.get_state("auto-mute"):
         return
     if gid in utils.init_value("recall", "enable-groups", []) and uid not in utils.get_admins():
-        await bot.delete_msg(message_id=msg_id)
+        await executor.call(bot, "delete_msg", critical=False, message_id=msg_id)
     if black_list.in_black_list(uid):
-        try:
-            await bot.delete_msg(message_id=msg_id)
-            await bot.set_group_ban(group_id=gid, user_id=int(uid), duration=utils.init_value("auto-mute", "mute-time"
-                                                                                                           "-blocked") * 60)
-            await bot.send_private_msg(user_id=int(uid),
-                                       message=f"[AutoMute] 你的uid存在于机器人黑名单中, 如果你认为你的封禁是错误的, 请联系任意管理员进行申诉\nReason:"
-                                               f" {black_list.get_user(uid)['reason']}\n(请勿回复此消息)")
-        except ActionFailed:
-            pass
+        audit_log.write("auto-mute", uid=uid, gid=gid, rule="black-list", message=msg)
+        await punish(bot, gid, uid, msg_id, utils.init_value("auto-mute", "mute-time-blocked") * 60,
+                     f"[AutoMute] 你的uid存在于机器人黑名单中, 如果你认为你的封禁是错误的, 请联系任意管理员进行申诉\nReason:"
+                     f" {black_list.get_user(uid)['reason']}\n(请勿回复此消息)")
+        run_background(recent_messages.purge(gid, uid, exclude=msg_id))
         return
-    blocked_words = utils.init_value("auto-mute", "blocked-words", [])
-    blocked_pattern = utils.init_value("auto-mute", "blocked-pattern", [])
-    full_match = utils.init_value("auto-mute", "blocked-words-full-match", [])
     mute_time = utils.init_value("auto-mute", "mute-time") * 60
-    bypass_long = utils.init_value("auto-mute", "bypass-long")
-    should_mute = False
     if len(msg.split("\n")) > utils.init_value("auto-mute", "long-message-lines"):
-        try:
-            await bot.delete_msg(message_id=msg_id)
-            await bot.set_group_ban(group_id=gid, user_id=int(uid), duration=utils.init_value("auto-mute", "mute-time"
-                                                                                                           "-long-message") * 60)
-            await bot.send_private_msg(user_id=int(uid),
-                                       message=f"[AutoMute] 群{gid}禁止发送长消息")
-        except ActionFailed:
-            pass
+        audit_log.write("auto-mute", uid=uid, gid=gid, rule="long-message", message=msg)
+        await punish(bot, gid, uid, msg_id, utils.init_value("auto-mute", "mute-time-long-message") * 60,
+                     f"[AutoMute] 群{gid}禁止发送长消息")
         return
-    for word in blocked_words:
-        if word in msg and len(msg) > bypass_long:
-            should_mute = True
-    for pattern in blocked_pattern:
-        if re.match(pattern, msg):
-            should_mute = True
-    for s in full_match:
-        if msg == s:
-            should_mute = True
-    if should_mute:
-        try:
-            await bot.delete_msg(message_id=msg_id)
-            await bot.set_group_ban(group_id=gid, user_id=int(uid), duration=mute_time)
-            await bot.send_private_msg(user_id=int(uid), message="[AutoMute] 你发送的消息存在违禁词, 如果你认为此消息是错误的, 请给任意管理员反馈, "
-                                                                 "以帮助我们改善机器人(请勿回复此消息)")
-        except ActionFailed:
-            pass
+    if mute_rules.get().blocked(msg):
+        audit_log.write("auto-mute", uid=uid, gid=gid, rule="blocked-words", message=msg)
+        await punish(bot, gid, uid, msg_id, mute_time, "[AutoMute] 你发送的消息存在违禁词, 如果你认为此消息是错误的, 请给任意管理员反馈, "
+                                                       "以帮助我们改善机器人(请勿回复此消息)")
+        return
+    banned = await image_hashes.banned(event.message)
+    if banned is not None:
+        audit_log.write("auto-mute", uid=uid, gid=gid, rule="banned-image", image=f"{banned:016x}")
+        await punish(bot, gid, uid, msg_id, mute_time, "[AutoMute] 你发送的图片存在于违禁图片列表中, 如果你认为此消息是错误的, "
+                                                       "请给任意管理员反馈(请勿回复此消息)")
+
+
+async def punish(bot: Bot, gid: int, uid: str, msg_id: int, duration: int, notice: str):
+    """同时撤回消息、禁言和私信通知, 短时间内重复违规只撤回消息"""
+    await executor.run(
+        executor.call(bot, "delete_msg", critical=False, message_id=msg_id),
+        executor.call(bot, "set_group_ban", key=(str(gid), uid), group_id=gid, user_id=int(uid), duration=duration),
+        executor.call(bot, "send_private_msg", key=(str(gid), uid), critical=False, user_id=int(uid), message=notice)
+    )
+
+
+@command("banimage", aliases={"banimg"}, module="auto-mute", admin=True, args=[Arg("action", default="add")],
+         usage="[AutoMute] 回复一条带图片的消息 -> /banimage [add|remove]")
+async def on_handle(matcher: Matcher, event: GroupMessageEvent, action: str):
+    if action not in ("add", "remove"):
+        await matcher.finish("[AutoMute] 错误的使用方法 -> /banimage [add|remove]")
+    if Image is None:
+        await matcher.finish("[AutoMute] 没有安装Pillow, 无法检查图片")
+    if event.reply is None or not any(segment.type == "image" for segment in event.reply.message):
+        await matcher.finish("[AutoMute] 请回复一条带图片的消息")
+    values = await image_hashes.hashes_of(event.reply.message)
+    if not values:
+        await matcher.finish("[AutoMute] 图片下载失败或格式不支持")
+    banned: list[str] = list(utils.init_value("auto-mute", "banned-images", []))
+    if action == "add":
+        changed = [f"{value:016x}" for value in values if f"{value:016x}" not in banned]
+        banned.extend(changed)
+    else:
+        # 移除所有与这张图片相似的违禁哈希
+        threshold = utils.init_value("auto-mute", "image-threshold")
+        matched = {f"{h:016x}" for value in values for _, h in image_hashes.get().tree.search(value, threshold)}
+        changed = [value for value in banned if value in matched]
+        banned = [value for value in banned if value not in matched]
+    if not changed:
+        await matcher.finish("[AutoMute] 违禁图片列表没有变化")
+    utils.set_value("auto-mute", "banned-images", banned)
+    audit_log.write(f"banned-image-{action}", gid=event.group_id, operator=event.get_user_id(),
+                    uid=str(event.reply.sender.user_id), images=changed)
+    await matcher.finish(f"[AutoMute] 已{'添加' if action == 'add' else '移除'}{len(changed)}个违禁图片哈希")
 
 
 utils.init_module("auto-mute")
@@ -547,6 +2914,11 @@ utils.init_value("auto-mute", "mute-time", 10)  # 禁言时间(触发关键词)
 utils.init_value("auto-mute", "mute-time-blocked", 1440)  # 禁言时间(黑名单)
 utils.init_value("auto-mute", "mute-time-long-message", 1)  # 禁言时间(发送长消息)
 utils.init_value("auto-mute", "mute-blocked-users", True)  # 禁言黑名单用户
+utils.init_value("auto-mute", "banned-images", [])  # 违禁图片的dHash(十六进制)
+utils.init_value("auto-mute", "image-threshold", 6)  # 判定为相同图片的最大汉明距离(0-64)
+utils.init_value("auto-mute", "image-max-size", 4096)  # 图片下载上限(KB)
+utils.init_value("auto-mute", "image-concurrency", 4)  # 同时下载的图片数
+utils.init_value("auto-mute", "image-timeout", 10)
 
 
 # Module AutoMute end
@@ -556,9 +2928,10 @@ utils.init_value("auto-mute", "mute-blocked-users", True)  # 禁言黑名单用
 async def get_player_info(player: str):
     uuid = player
     if not len(player) > 17:
-        r = await get("https://api.mojang.com/users/profiles/minecraft/" + player)
-        j = r.json()
-        uuid = None if "errorMessage" in j else j["id"]
+        profile = await mojang_resolver.resolve(player)
+        if profile is None:
+            return None
+        uuid = profile["id"]
     r = await get("https://sessionserver.mojang.com/session/minecraft/profile/" + uuid)
     j = r.json()
     if "errorMessage" in j:
@@ -567,137 +2940,417 @@ async def get_player_info(player: str):
     data = json.loads(base64.b64decode(j["properties"][0]["value"]).decode("utf-8"))
     skin = data["textures"]["SKIN"]["url"]
     model = "slim" if "metadata" in data["textures"]["SKIN"] else "normal"
+    cape = data["textures"]["CAPE"]["url"] if "CAPE" in data["textures"] else None
+    if utils.get_state("image-cache"):
+        image_cache.prefetch(skin, cape)
     return {
         "uuid": uuid,
         "username": username,
         "skin": skin,
-        "skin-model": model
+        "skin-model": model,
+        "cape": cape
     }
 
 
 # Module Player Info end
 
 
-# Module Minecraft start
-@on_command("mc", aliases={"minecraft"}).handle()
-async def on_handle(matcher: Matcher, bot: Bot, event: Event):
-    if not utils.get_state("minecraft"):
-        return
-    args = parse_arg(event.get_plaintext())
-    if len(args) == 1:
-        player = args[0]
-        try:
-            info = await get_player_info(player)
-            msg = Message(
-                f"[MC] UserName: {info['username']}\n"
-                f"UUID: {info['uuid']}\n"
-                f"NameMC: https://namemc.com/profile/{info['uuid']}\n"
-                f"Cape: 使用 /ofcape {info['username']} 或 /mojangcape {info['username']} 进行查询\n"
-                f"SkinUrl: {info['skin']} (Model: {info['skin-model']})\n"
-                f"[CQ:image,file={info['skin']},cache=0]"
-            )
-        except:
-            msg = f"[MC] Player {player} not found."
+# Module SkinRender start
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def decode_png(content: bytes) -> "np.ndarray":
+    """解码8位非隔行PNG, 返回 (height, width, 4) 的RGBA数组; 安装了Pillow时由Pillow解码"""
+    if not content.startswith(PNG_SIGNATURE):
+        raise ValueError("not a png")
+    if Image is not None:
+        with Image.open(io.BytesIO(content)) as image:
+            return np.asarray(image.convert("RGBA"), np.uint8)
+    pos = len(PNG_SIGNATURE)
+    header = None
+    palette = None
+    transparency = b""
+    idat = []
+    while pos + 8 <= len(content):
+        length, chunk_type = struct.unpack(">I4s", content[pos:pos + 8])
+        data = content[pos + 8:pos + 8 + length]
+        pos += length + 12
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", data)
+        elif chunk_type == b"PLTE":
+            palette = np.frombuffer(data, np.uint8).reshape(-1, 3)
+        elif chunk_type == b"tRNS":
+            transparency = data
+        elif chunk_type == b"IDAT":
+            idat.append(data)
+        elif chunk_type == b"IEND":
+            break
+    if header is None:
+        raise ValueError("missing IHDR")
+    width, height, depth, color_type, _, _, interlace = header
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color_type)
+    if depth != 8 or interlace or channels is None:
+        raise ValueError(f"unsupported png (depth={depth}, color={color_type}, interlace={interlace})")
+    stride = width * channels
+    raw = np.frombuffer(zlib.decompress(b"".join(idat)), np.uint8)[:height * (stride + 1)]
+    raw = raw.reshape(height, stride + 1)
+    rows = np.zeros((height, stride), np.uint8)
+    prev = np.zeros(stride, np.uint8)
+    for y in range(height):
+        filter_type = raw[y, 0]
+        line = raw[y, 1:]
+        if filter_type == 0:  # None
+            cur = line.copy()
+        elif filter_type == 1:  # Sub: 同一通道上的前缀和
+            cur = (np.cumsum(line.reshape(width, channels), axis=0, dtype=np.uint32) % 256).astype(np.uint8).ravel()
+        elif filter_type == 2:  # Up
+            cur = line + prev
+        elif filter_type in (3, 4):  # Average / Paeth 依赖左侧像素, 逐像素计算
+            cur = np.zeros(stride, np.uint8)
+            up = prev.astype(np.int16)
+            left = np.zeros(channels, np.int16)
+            up_left = np.zeros(channels, np.int16)
+            for x in range(0, stride, channels):
+                b = up[x:x + channels]
+                if filter_type == 3:
+                    predictor = (left + b) // 2
+                else:
+                    p = left + b - up_left
+                    pa, pb, pc = np.abs(p - left), np.abs(p - b), np.abs(p - up_left)
+                    predictor = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, b, up_left))
+                cur[x:x + channels] = (line[x:x + channels] + predictor) % 256
+                left = cur[x:x + channels].astype(np.int16)
+                up_left = b
+        else:
+            raise ValueError(f"bad png filter {filter_type}")
+        rows[y] = cur
+        prev = cur
+    pixels = rows.reshape(height, width, channels)
+    if color_type == 6:
+        return pixels
+    rgba = np.full((height, width, 4), 255, np.uint8)
+    if color_type == 2:
+        rgba[..., :3] = pixels
+    elif color_type == 0:
+        rgba[..., :3] = pixels
+    elif color_type == 4:
+        rgba[..., :3] = pixels[..., :1]
+        rgba[..., 3] = pixels[..., 1]
+    else:
+        if palette is None:
+            raise ValueError("missing PLTE")
+        indexes = pixels[..., 0]
+        rgba[..., :3] = palette[indexes]
+        alpha = np.full(256, 255, np.uint8)
+        alpha[:len(transparency)] = np.frombuffer(transparency, np.uint8)
+        rgba[..., 3] = alpha[indexes]
+    return rgba
+
+
+def encode_png(pixels: "np.ndarray") -> bytes:
+    """把RGBA数组编码为PNG"""
+    height, width, _ = pixels.shape
+
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+    raw = np.hstack([np.zeros((height, 1), np.uint8), pixels.reshape(height, width * 4)])
+    return (PNG_SIGNATURE
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 9))
+            + chunk(b"IEND", b""))
+
+
+def alpha_composite(base: "np.ndarray", layer: "np.ndarray") -> "np.ndarray":
+    alpha = layer[..., 3:4].astype(np.float32) / 255
+    out = base.copy()
+    out[..., :3] = (layer[..., :3] * alpha + base[..., :3] * (1 - alpha)).astype(np.uint8)
+    out[..., 3] = np.maximum(base[..., 3], layer[..., 3])
+    return out
+
+
+def render_skin(texture: "np.ndarray", view: str = "body", slim: bool = False) -> "np.ndarray":
+    """渲染皮肤正面, view为head或body"""
+
+    def face(x: int, y: int, w: int, h: int) -> "np.ndarray":
+        return texture[y:y + h, x:x + w]
+
+    legacy = texture.shape[0] == 32  # 1.8之前的64x32皮肤
+    hat = face(40, 8, 8, 8)
+    if legacy and hat[..., 3].min() >= 128:
+        hat = np.zeros_like(hat)  # 旧皮肤的帽子层经常是不透明的纯色, 和原版一样忽略
+    head = alpha_composite(face(8, 8, 8, 8), hat)
+    if view == "head":
+        return head
+    arm_width = 3 if slim else 4
+    body = face(20, 20, 8, 12)
+    right_arm = face(44, 20, arm_width, 12)
+    right_leg = face(4, 20, 4, 12)
+    if legacy:
+        left_arm = right_arm[:, ::-1]
+        left_leg = right_leg[:, ::-1]
     else:
-        msg = "[MC] /mc <playerUuid|playerUserName>"
+        left_arm = face(36, 52, arm_width, 12)
+        left_leg = face(20, 52, 4, 12)
+        body = alpha_composite(body, face(20, 36, 8, 12))
+        right_arm = alpha_composite(right_arm, face(44, 36, arm_width, 12))
+        left_arm = alpha_composite(left_arm, face(52, 52, arm_width, 12))
+        right_leg = alpha_composite(right_leg, face(4, 36, 4, 12))
+        left_leg = alpha_composite(left_leg, face(4, 52, 4, 12))
+    canvas = np.zeros((32, 16, 4), np.uint8)
+    canvas[0:8, 4:12] = head
+    canvas[8:20, 4:12] = body
+    canvas[8:20, 4 - arm_width:4] = right_arm  # 玩家的右手在画面左侧
+    canvas[8:20, 12:12 + arm_width] = left_arm
+    canvas[20:32, 4:8] = right_leg
+    canvas[20:32, 8:12] = left_leg
+    return canvas
+
+
+async def render_player_skin(info: dict, view: str = "body", scale: int | None = None) -> str | None:
+    """渲染玩家皮肤预览并缓存, 返回图片CQ码"""
+    if np is None or not utils.get_state("skin-render"):
+        return None
+    scale = scale or utils.init_value("skin-render", "scale")
+    key = f"render-{image_cache.key_of(info['skin'])}-{view}-{info['skin-model']}-{scale}"
+    path = image_cache.lookup(key)
+    if path is None:
+        texture_path = await image_cache.fetch(info["skin"])
+        if texture_path is None:
+            return None
+        with open(texture_path, "rb") as f:
+            content = f.read()
+        try:
+            # 解码和渲染是CPU密集的, 放到线程中执行, 不阻塞其他事件
+            rendered = await asyncio.to_thread(render_skin_png, content, view, info["skin-model"] == "slim", scale)
+        except (ValueError, OSError, zlib.error):
+            return None
+        path = image_cache.put(key, rendered)
+    return cq_local_image(path)
+
+
+def render_skin_png(content: bytes, view: str, slim: bool, scale: int) -> bytes:
+    pixels = render_skin(decode_png(content), view, slim)
+    return encode_png(pixels.repeat(scale, axis=0).repeat(scale, axis=1))
+
+
+utils.init_module("skin-render")
+utils.init_value("skin-render", "scale", 8)  # 放大倍数
+
+
+# Module SkinRender end
+
+
+# Module Minecraft start
+@command("mc", aliases={"minecraft"}, module="minecraft", limit="mojang",
+         args=[Arg("player"), Arg("view", choice("head", "body"), default="body")],
+         usage="[MC] /mc <playerUuid|playerUserName> [head|body]")
+async def on_handle(matcher: Matcher, player: str, view: str):
+    try:
+        info = await get_player_info(player)
+        image = await render_player_skin(info, view) or await cq_image(info['skin'])
+        msg = Message(
+            f"[MC] UserName: {info['username']}\n"
+            f"UUID: {info['uuid']}\n"
+            f"NameMC: https://namemc.com/profile/{info['uuid']}\n"
+            f"Cape: 使用 /ofcape {info['username']} 或 /mojangcape {info['username']} 进行查询\n"
+            f"SkinUrl: {info['skin']} (Model: {info['skin-model']})\n"
+            f"{image}"
+        )
+    except:
+        msg = f"[MC] Player {player} not found."
     await matcher.finish(msg)
 
 
 utils.init_module("minecraft")
+utils.init_value("minecraft", "batch-window", 10)  # 合并用户名查询的等待时间(ms)
 
 
 # Module Minecraft end
 
 
 # Module Hypixel start
-async def get_hypixel_info(username: str, key) -> dict:
-    info = await get_player_info(username)
-    uuid = info['uuid']
+class HypixelClient(object):
+    """Hypixel API 客户端
 
-    u1 = "https://api.hypixel.net/player?key={}&uuid={}".format(key, uuid)
-    u2 = "https://api.hypixel.net/recentgames?key={}&uuid={}".format(key, uuid)
-    status_api = "https://api.hypixel.net/status?key={}&uuid={}".format(key, uuid)
-    guild_api = "https://api.hypixel.net/guild?key={}&player={}".format(key, uuid)
+    所有请求共用一个信号量限制并发数; 被限流(429)时按 RateLimit-Reset/Retry-After 暂停全部请求再重试"""
 
-    player = await get(u1)
-    recentgames = await get(u2)
-    status = await get(status_api)
-    guild = await get(guild_api)
+    api = "https://api.hypixel.net/"
 
-    if player.status_code != 200:
-        return {"state": False, "username": username}
-    if recentgames.status_code != 200:
-        return {"state": False, "username": username}
-    if status.status_code != 200:
-        return {"state": False, "username": username}
-    if guild.status_code != 200:
-        return {"state": False, "username": username}
+    def __init__(self, concurrency: int):
+        object.__init__(self)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.resume_at = 0.0
+
+    async def request(self, endpoint: str, **params) -> dict | None:
+        params["key"] = utils.init_value("hypixel", "hypkey")
+        async with self.semaphore:
+            for _ in range(3):
+                delay = self.resume_at - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    r = await get(self.api + endpoint, params=params)
+                except httpx.HTTPError:
+                    return None
+                if r.status_code == 429:
+                    wait = r.headers.get("RateLimit-Reset") or r.headers.get("Retry-After") or 10
+                    self.resume_at = max(self.resume_at, time.time() + float(wait))
+                    continue
+                if r.status_code != 200:
+                    return None
+                return r.json()
+        return None
 
-    p = player.json()['player']
-    r = recentgames.json()['games']
-    s = status.json()['session']['online']
-    g = guild.json()['guild']['name']
 
-    displayname = p['displayname']
-    rank = p['newPackageRank']
-    langrage = p['userLanguage']
-    firstlogin: int = p['firstLogin']
-    lastlogin: int = p['lastLogin']
+def hypixel_rank(p: dict) -> str:
+    if p.get("rank") not in (None, "NORMAL"):
+        return p["rank"]
+    if p.get("monthlyPackageRank") == "SUPERSTAR":
+        return "MVP_PLUS_PLUS"
+    return p.get("newPackageRank") or p.get("packageRank") or "无"
 
-    firstlogin_local = time.localtime(firstlogin / 1000)
-    firstlogin_dt = time.strftime("%Y-%m-%d %H:%M:%S", firstlogin_local)
-    lastlogin_local = time.localtime(lastlogin / 1000)
-    lastlogin_dt = time.strftime("%Y-%m-%d %H:%M:%S", lastlogin_local)
 
-    if s == "true":
-        st = "在线"
-    else:
-        st = "离线"
+def format_hypixel_time(timestamp: int | None) -> str:
+    if not timestamp:
+        return "未知"
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp / 1000))
+
+
+async def get_hypixel_uuid(player: str) -> str | None:
+    if len(player) > 17:
+        return player.replace("-", "")
+    profile = await mojang_resolver.resolve(player)
+    return profile["id"] if profile is not None else None
 
-    if not r: r = "无"
+
+async def get_hypixel_info(username: str) -> dict:
+    uuid = await get_hypixel_uuid(username)
+    if uuid is None:
+        return {"state": False, "username": username}
+    player, recentgames, status, guild = await asyncio.gather(
+        hypixel.request("player", uuid=uuid),
+        hypixel.request("recentgames", uuid=uuid),
+        hypixel.request("status", uuid=uuid),
+        hypixel.request("guild", player=uuid)
+    )
+    if player is None or player.get("player") is None:
+        return {"state": False, "username": username}
+
+    p = player['player']
+    r = recentgames['games'] if recentgames is not None else []
+    s = status is not None and status['session']['online']
+    g = guild['guild']['name'] if guild is not None and guild.get('guild') else "无"
 
     return {"state": True,
-            "dn": displayname,
-            "rank": rank,
-            "fl": firstlogin_dt,
-            "ll": lastlogin_dt,
-            "rg": r,
-            "lan": langrage,
-            "status": st,
+            "dn": p['displayname'],
+            "rank": hypixel_rank(p),
+            "fl": format_hypixel_time(p.get('firstLogin')),
+            "ll": format_hypixel_time(p.get('lastLogin')),
+            "rg": r[0]['gameType'] if r else "无",
+            "lan": p.get('userLanguage', "ENGLISH"),
+            "status": "在线" if s else "离线",
             "guild": g
             }
 
 
-@on_command("hyp", aliases={"hypixel"}).handle()
-async def on_handle(matcher: Matcher, event: Event):
-    if not utils.get_state("hypixel"):
-        return
-    args = parse_arg(event.get_plaintext())
-    key = utils.init_value("hypixel", "hypkey")
-    if len(args) == 1:
+async def get_hypixel_member(uuid: str) -> dict:
+    """公会成员/多玩家列表用的简要信息: 名称、等级、在线状态和最后登录"""
+    player, status = await asyncio.gather(hypixel.request("player", uuid=uuid), hypixel.request("status", uuid=uuid))
+    p = player.get("player") if player is not None else None
+    if p is None:
+        return {"state": False, "dn": uuid}
+    return {"state": True,
+            "dn": p['displayname'],
+            "rank": hypixel_rank(p),
+            "status": "在线" if status is not None and status['session']['online'] else "离线",
+            "ll": format_hypixel_time(p.get('lastLogin'))
+            }
+
+
+def format_hypixel_info(info: dict) -> str:
+    return (f"[HYPIXEL] {info['dn']}的Hypixel用户数据：\n"
+            f"会员等级：{info['rank']}\n"
+            f"工会：{info['guild']}\n"
+            f"最近一次游戏：{info['rg']}\n"
+            f"当前状态：{info['status']}\n"
+            f"玩家语言：{info['lan']}\n"
+            f"首次登录：{info['fl']}\n"
+            f"最后登录：{info['ll']}")
+
+
+async def send_forward(bot: Bot, event: Event, messages: list[str]):
+    """以合并转发的形式发送多条消息"""
+    nodes = [{"type": "node", "data": {"name": BOT_NAME, "uin": bot.self_id, "content": msg}} for msg in messages]
+    if isinstance(event, GroupMessageEvent):
+        await bot.send_group_forward_msg(group_id=event.group_id, messages=nodes)
+    else:
+        await bot.send_private_forward_msg(user_id=int(event.get_user_id()), messages=nodes)
+
+
+async def stream_pages(bot: Bot, event: Event, title: str, jobs: list[Awaitable[str]]):
+    """jobs全部同时开始(由HypixelClient限制并发), 每凑齐一页就按顺序发送一条合并转发消息"""
+    tasks = [asyncio.ensure_future(job) for job in jobs]
+    page_size = utils.init_value("hypixel", "page-size")
+    pages = (len(tasks) + page_size - 1) // page_size
+    try:
+        for page in range(pages):
+            lines = await asyncio.gather(*tasks[page * page_size:(page + 1) * page_size])
+            await send_forward(bot, event, [f"{title} ({page + 1}/{pages})", *lines])
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@command("hyp", aliases={"hypixel"}, module="hypixel", limit="hypixel", args=[Arg("args", many=True)])
+async def on_handle(matcher: Matcher, bot: Bot, event: Event, args: list[str]):
+    if len(args) >= 2 and args[0] == "guild":
+        name = " ".join(args[1:])
+        guild = await hypixel.request("guild", name=name)
+        if guild is None or guild.get("guild") is None:
+            await matcher.finish(f"[HYPIXEL] Guild {name} not found.")
+        g = guild["guild"]
+        members = g["members"]
+        await matcher.send(f"[HYPIXEL] 公会 {g['name']} 共 {len(members)} 名成员, 正在查询...")
+
+        async def member_line(member: dict) -> str:
+            info = await get_hypixel_member(member["uuid"])
+            if not info["state"]:
+                return f"{member['uuid']} ({member.get('rank', '成员')})"
+            return (f"{info['dn']} [{info['rank']}] {member.get('rank', '成员')}\n"
+                    f"{info['status']}, 最后登录：{info['ll']}")
+
+        await stream_pages(bot, event, f"[HYPIXEL] 公会 {g['name']}", [member_line(member) for member in members])
+        await matcher.finish()
+    elif len(args) == 1:
         player = args[0]
-        info = await get_hypixel_info(player, key)
+        info = await get_hypixel_info(player)
         if info["state"]:
-            msg = Message(
-                f"[HYPIXEL] {info['dn']}的Hypixel用户数据：\n"
-                f"会员等级：{info['rank']}\n"
-                f"工会：{info['guild']}\n"
-                f"最近一次游戏：{info['rg']}\n"
-                f"当前状态：{info['status']}\n"
-                f"玩家语言：{info['lan']}\n"
-                f"首次登录：{info['fl']}\n"
-                f"最后登录：{info['ll']}\n"
-            )
+            msg = Message(format_hypixel_info(info))
         else:
             msg = f"[HYPIXEL] Player {player} not found."
+    elif len(args) > 1:
+        players = list(dict.fromkeys(args))[:utils.init_value("hypixel", "max-players")]
+
+        async def player_info(player: str) -> str:
+            info = await get_hypixel_info(player)
+            return format_hypixel_info(info) if info["state"] else f"[HYPIXEL] Player {player} not found."
+
+        await stream_pages(bot, event, f"[HYPIXEL] {len(players)} 名玩家", [player_info(player) for player in players])
+        await matcher.finish()
     else:
-        msg = "[HYPIXEL] /hyp <playerUuid|playerUserName>"
+        msg = ("[HYPIXEL] /hyp <playerUuid|playerUserName> [player...]\n"
+               "/hyp guild <guildName>")
 
     await matcher.finish(msg)
 
 
 utils.init_module("hypixel")
 utils.init_value("hypixel", "hypkey", "")
+utils.init_value("hypixel", "concurrency", 4)  # 同时进行的API请求数
+utils.init_value("hypixel", "page-size", 20)  # 每条合并转发消息包含的条目数
+utils.init_value("hypixel", "max-players", 20)  # 一次最多查询的玩家数
+hypixel = HypixelClient(utils.init_value("hypixel", "concurrency"))
 
 # Module Hypixel end
 
@@ -706,12 +3359,9 @@ utils.init_value("hypixel", "hypkey", "")
 rename_state = False
 
 
-@on_command("renameall").handle()
-async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
+@command("renameall", admin=True, args=[Arg("args", many=True)])
+async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent, args: list[str]):
     global rename_state
-    if event.get_user_id() not in utils.get_admins():
-        return
-    args = parse_arg(event.get_plaintext())
     if len(args) == 0:
         await matcher.finish("[Rename] 给成员编序号 -> /renameall [--reset] [--cancel]")
     if "--cancel" in args:
@@ -733,89 +3383,54 @@ async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
         target_uid = int(user["user_id"])
         if int(bot.self_id) == target_uid:
             continue
-        await bot.set_group_card(group_id=gid, user_id=target_uid,
-                                 card=(target_name + f"#{'0' * (4 - len(str(i)))}{i}") if target_name else "")
+        await bot_pool.call(bot, "set_group_card", {
+            "group_id": gid, "user_id": target_uid,
+            "card": (target_name + f"#{'0' * (4 - len(str(i)))}{i}") if target_name else ""})
         await asyncio.sleep(2)
     rename_state = False
     await matcher.finish("[Rename] Done in {}s".format(round(time.time() - time_start, 2)))
 
 
-@on_command("rename").handle()
-async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
-    uid = event.get_user_id()
-    gid = event.group_id
-    if uid not in utils.get_admins():
-        return
-    card = " ".join(parse_arg(event.get_plaintext()))
-    await bot.set_group_card(user_id=int(bot.self_id), group_id=gid, card=card)
+@command("rename", admin=True, args=[Arg("card", rest=True, default="")])
+async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent, card: str):
+    await bot.set_group_card(user_id=int(bot.self_id), group_id=event.group_id, card=card)
     await matcher.finish(f"[Rename] 已将Bot自身的群昵称设置为 {card}")
 
 
-@on_command("title").handle()
-async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
-    uid = event.get_user_id()
-    gid = event.group_id
-    if uid not in utils.get_admins():
-        return
-    args = parse_arg(event.get_plaintext())
-    if len(args) > 1:
-        await matcher.finish("[Title] 设置专属头衔 -> /title <target> [title]>\n"
-                             "需要注意的是, 如果要设置超长头衔, title中不能包含中文")
-    else:
-        target = args[0]
-        title = "-".join(args[1:]) if len(args) >= 2 else ""
-        await bot.set_group_special_title(group_id=gid, user_id=int(target), special_title=title, duration=-1)
-        await matcher.finish("[Title] 设置成功")
+@command("title", admin=True, args=[Arg("target", uid), Arg("title", rest=True, default="")],
+         usage="[Title] 设置专属头衔 -> /title <target> [title]>\n需要注意的是, 如果要设置超长头衔, title中不能包含中文")
+async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent, target: str, title: str):
+    await bot_pool.call(bot, "set_group_special_title", {"group_id": event.group_id, "user_id": int(target),
+                                                         "special_title": title, "duration": -1})
+    await matcher.finish("[Title] 设置成功")
 
 
-@on_command("renametarget").handle()
-async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
-    uid = event.get_user_id()
-    gid = event.group_id
-    if uid not in utils.get_admins():
-        return
-    args = parse_arg(event.get_plaintext())
-    if len(args) <= 1:
-        await matcher.finish("[Rename] 命名某个UID -> /renametarget <target-uid> <nickname>")
-    target = args[0]
-    card = " ".join(args[1:])
-    await bot.set_group_card(user_id=int(target), group_id=gid, card=card)
+@command("renametarget", admin=True, args=[Arg("target", uid), Arg("card", rest=True)],
+         usage="[Rename] 命名某个UID -> /renametarget <target-uid> <nickname>")
+async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent, target: str, card: str):
+    await bot_pool.call(bot, "set_group_card", {"user_id": int(target), "group_id": event.group_id, "card": card})
     await matcher.finish(f"[Rename] 已将 {await get_user_name(bot, target)} ({target}) 的昵称设置为 {card}")
 
 
-@on_command("renamegroup", aliases={"renameg"}).handle()
-async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
-    uid = event.get_user_id()
-    gid = event.group_id
-    if uid not in utils.get_admins():
-        return
-    name = " ".join(parse_arg(event.get_plaintext()))
-    await bot.set_group_name(group_id=gid, group_name=name)
+@command("renamegroup", aliases={"renameg"}, admin=True, args=[Arg("name", rest=True)],
+         usage="[Rename] 设置群名称 -> /renamegroup <name>")
+async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent, name: str):
+    await bot_pool.call(bot, "set_group_name", {"group_id": event.group_id, "group_name": name})
     await matcher.finish(f"[Rename] 成功将群组名称设置为 {name}")
 
 
-@on_command("setprofile").handle()
-async def on_handle(matcher: Matcher, bot: Bot, event: Event):
+@command("setprofile", admin=True, args=[Arg("name", rest=True)],
+         usage="[Rename] 设置Bot资料卡 -> /setprofile <nickName>")
+async def on_handle(matcher: Matcher, bot: Bot, name: str):
     """设置Bot自身的资料卡"""
-    uid = event.get_user_id()
-    if uid not in utils.get_admins():
-        return
-    name = " ".join(parse_arg(event.get_plaintext()))
-    if not name.replace(" ", ""):
-        await matcher.finish("[Rename] 设置Bot资料卡 -> /setprofile <nickName>")
     await bot.set_qq_profile(nickname=name)
     await matcher.finish(f"[Rename] 成功将Bot资料卡设置为 {name}")
 
 
-@on_command("phone").handle()
-async def on_handle(matcher: Matcher, bot: Bot, event: Event):
+@command("phone", admin=True, args=[Arg("name", rest=True)],
+         usage="[Rename] 设置Bot在线机型(此功能已被和谐) -> /phone <nickName>")
+async def on_handle(matcher: Matcher, bot: Bot, name: str):
     """设置机型"""
-    uid = event.get_user_id()
-    if uid not in utils.get_admins():
-        return
-    name = " ".join(parse_arg(event.get_plaintext()))
-    if not name.replace(" ", ""):
-        await matcher.finish("[Rename] 设置Bot在线机型(此功能已被和谐) -> /phone <nickName>")
     await bot._set_model_show(model=name, model_show="1")
     await matcher.finish(f"[Rename] 成功将Bot在线机型设置为 {name}")
 
@@ -823,84 +3438,110 @@ async def on_handle(matcher: Matcher, bot: Bot, event: Event):
 # Module renameAll end
 
 # Module memberManager start
-@on_command("kick").handle()
-async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
-    uid = event.get_user_id()
+@command("kick", admin=True, args=[Arg("target_uid", uid), Arg("reason", rest=True, default=None)],
+         usage="[MemberManager] 踢出群成员 -> /kick <uid> [bl-reason]")
+async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent, target_uid: str, reason: str | None):
+    operator = event.get_user_id()
     gid = event.group_id
-    if uid not in utils.get_admins():
-        return
-    args = parse_arg(event.get_plaintext())
 
     async def kick(target):
         try:
             if target in utils.get_admins():
                 raise ActionFailed()
-            await bot.set_group_kick(user_id=int(target), group_id=gid, reject_add_request=False)
-        except ActionFailed:
+            await bot_pool.call(bot, "set_group_kick", {"user_id": int(target), "group_id": gid,
+                                                        "reject_add_request": False})
+        except (ActionFailed, NetworkError):
             await matcher.finish(f"[MemberManager] 你没有权限踢出{target}")
 
-    if len(args) == 1:
-        target_uid = args[0]
-        await kick(target_uid)
-    elif len(args) >= 2:
-        target_uid = args[0]
-        reason = " ".join(args[1:])
-        await kick(target_uid)
+    await kick(target_uid)
+    audit_log.write("kick", uid=target_uid, gid=gid, operator=operator, reason=reason)
+    run_background(recent_messages.purge(gid, target_uid))
+    if reason is not None:
         black_list.add_user(target_uid, reason)
-    else:
-        await matcher.finish("[MemberManager] 踢出群成员 -> /kick <uid> [bl-reason]")
+        scheduler.cancel(f"blacklist-expire:{target_uid}")
+        audit_log.write("blacklist-add", uid=target_uid, gid=gid, operator=operator, reason=reason)
 
 
-@on_command("mute").handle()
-async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
-    uid = event.get_user_id()
+def parse_purge_minutes(text: str) -> float:
+    """正的有限分钟数, 超过 recent-messages.max-purge-minutes 时截断"""
+    value = float(text)
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError(text)
+    return min(value, utils.init_value("recent-messages", "max-purge-minutes"))
+
+
+@command("purge", admin=True, args=[Arg("target_uid", uid), Arg("minutes", parse_purge_minutes, default=None)],
+         usage="[MemberManager] 撤回群成员最近的消息 -> /purge <uid> [minutes]")
+async def on_handle(matcher: Matcher, event: GroupMessageEvent, target_uid: str, minutes: float | None):
+    count = await recent_messages.purge(event.group_id, target_uid, minutes)
+    audit_log.write("purge", uid=target_uid, gid=event.group_id, operator=event.get_user_id(), count=count)
+    await matcher.finish(f"[MemberManager] 已撤回{target_uid}的{count}条消息")
+
+
+def parse_mute_time(text: str) -> int:
+    """d:h:m / h:m / m 格式的禁言时长, 返回秒数"""
+    units = (24 * 3600, 3600, 60)
+    t = [int(part) for part in text.split(":")]
+    if len(t) > len(units):
+        raise ValueError(text)
+    return sum(value * unit for value, unit in zip(t, units[len(units) - len(t):]))
+
+
+@command("mute", admin=True, args=[Arg("target_uid", uid), Arg("duration", parse_mute_time, default=0)],
+         usage="[MemberManager] 禁言群成员 -> /mute <uid> [time]\ntime参数不填或为0时代表解除禁言")
+async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent, target_uid: str, duration: int):
+    operator = event.get_user_id()
     gid = event.group_id
-    if uid not in utils.get_admins():
-        return
-    args = parse_arg(event.get_plaintext())
 
     async def mute(target, duration=0):
         try:
             if target in utils.get_admins():
                 raise ActionFailed()
-            await bot.set_group_ban(user_id=int(target), group_id=gid, duration=duration)
+            await bot_pool.call(bot, "set_group_ban", {"user_id": int(target), "group_id": gid,
+                                                       "duration": min(duration, MAX_BAN_TIME)})
+            job_id = f"mute-extend:{gid}:{target}"
+            if duration > MAX_BAN_TIME:
+                # QQ最多禁言30天, 到期前由调度器续期
+                scheduler.schedule(job_id, time.time() + MAX_BAN_TIME - 60, "mute-extend",
+                                   {"bot": bot.self_id, "gid": gid, "uid": target, "until": time.time() + duration})
+            else:
+                scheduler.cancel(job_id)
+            audit_log.write("mute", uid=target, gid=gid, operator=operator, duration=duration)
             await matcher.finish(f"[MemberManager] 禁言{target}成功")
-        except ActionFailed:
+        except (ActionFailed, NetworkError):
             await matcher.finish(f"[MemberManager] 你没有权限禁言{target}")
 
-    if len(args) == 1:
-        target_uid = args[0]
-        await mute(target_uid)
-    elif len(args) >= 2:
-        target_uid = args[0]
-        duration = 0
-        t = args[1].split(":")
-        if len(t) == 3:
-            duration += int(t[0]) * 3600 * 24  # d
-            duration += int(t[1]) * 3660  # h
-            duration += int(t[2]) * 60  # m
-        elif len(t) == 2:
-            duration += int(t[0]) * 3600  # h
-            duration += int(t[1]) * 60  # m
-        elif len(t) == 1:
-            duration += int(t[0]) * 60  # m
-        await mute(target_uid, duration)
-    else:
-        await matcher.finish("[MemberManager] 禁言群成员 -> /mute <uid> [time]\ntime参数不填或为0时代表解除禁言")
+    await mute(target_uid, duration)
+
+
+MAX_BAN_TIME = 30 * 24 * 3600
+
+
+async def on_mute_extend(args: dict):
+    """长时间禁言的续期"""
+    remaining = args["until"] - time.time()
+    bot = get_bots().get(args["bot"]) or next(iter(get_bots().values()), None)
+    if remaining <= 0 or bot is None:
+        return
+    await executor.call(bot, "set_group_ban", group_id=args["gid"], user_id=int(args["uid"]),
+                        duration=int(min(remaining, MAX_BAN_TIME)))
+    if remaining > MAX_BAN_TIME:
+        scheduler.schedule(f"mute-extend:{args['gid']}:{args['uid']}", time.time() + MAX_BAN_TIME - 60,
+                           "mute-extend", args)
+
+
+scheduler.register("mute-extend", on_mute_extend)
 
 
-@on_notice().handle()
+@on_notice(handlers=[trace_matcher]).handle()
 async def on_handle(bot: Bot, event: GroupBanNoticeEvent):
     uid = event.get_user_id()
     gid = event.group_id
     if uid in utils.get_admins():
-        try:
-            await bot.set_group_ban(group_id=gid, user_id=int(uid), duration=0)
-        except ActionFailed:
-            pass
+        await executor.call(bot, "set_group_ban", group_id=gid, user_id=int(uid), duration=0)
 
 
-@on_command("muteall").handle()
+@command("muteall", admin=True)
 async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
     gid = str(event.group_id)
     new_groups: list = utils.init_value("recall", "enable-groups")
@@ -916,7 +3557,7 @@ async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
             "添加到自动撤回列表中" if state else "从自动撤回列表中删除"))
 
 
-@on_message().handle()
+@on_message(handlers=[trace_matcher]).handle()
 async def on_handle(matcher: Matcher, bot: Bot, event: GroupMessageEvent):
     """Mute All handle"""
     gid = str(event.group_id)
@@ -929,34 +3570,39 @@ utils.init_module("recall")
 utils.init_value("recall", "enable-groups", [])
 
 
-@on_command("w", aliases={"pm", "whisper", "echopm"}).handle()
-async def on_handle(bot: Bot, event: Event, matcher: Matcher):
-    if event.get_user_id() not in utils.get_admins():
-        return
-    arg = parse_arg(event.get_plaintext())
-    if len(arg) < 2:
-        await matcher.finish(
-            "[MemberManager] 私信某人-> /w <target-uid: int> <message: str>\n别名: /pm /whisper /echopm")
-    target = arg[0]
-    msg = " ".join(arg[1:])
+@command("w", aliases={"pm", "whisper", "echopm"}, admin=True, args=[Arg("target", uid), Arg("msg", rest=True)],
+         usage="[MemberManager] 私信某人-> /w <target-uid: int> <message: str>\n别名: /pm /whisper /echopm")
+async def on_handle(bot: Bot, matcher: Matcher, target: str, msg: str):
     try:
         await bot.send_private_msg(user_id=int(target), message=Message(msg))
         await matcher.finish(f"[MemberManager] 私信 {await get_user_name(bot, target)} ({target}) 成功")
     except ActionFailed:
         await matcher.finish(f"[MemberManager] 私信{target}失败, 可能没加好友或被对方屏蔽")
-    except ValueError:
-        await matcher.finish(f"[MemberManager] UID不正确")
 
 
-@on_command("echo", aliases={"say"}).handle()
-async def on_handle(matcher: Matcher, event: Event):
+@command("echo", aliases={"say"}, admin=True, args=[Arg("message", rest=True)],
+         usage="[Echo] 复读 -> /echo <message>")
+async def on_handle(matcher: Matcher, message: str):
     """Echo handle"""
-    if event.get_user_id() not in utils.get_admins():
-        return
-    arg = parse_arg(event.get_plaintext())
-    if len(arg) == 0:
-        await matcher.finish("[Echo] 复读 -> /echo <message>")
-    await matcher.finish(" ".join(arg))
+    await matcher.finish(message)
+
+
+@command("audit", admin=True, args=[Arg("arg", many=True)])
+async def on_handle(matcher: Matcher, arg: list[str]):
+    """查询管理日志"""
+    usage = "[Audit] 查询管理日志 -> /audit <uid> [limit] 或 /audit group <gid> [limit]"
+    by_group = len(arg) >= 2 and arg[0] == "group"
+    target = arg[1] if by_group else arg[0] if arg else ""
+    limit = arg[2 if by_group else 1] if len(arg) > (2 if by_group else 1) else "20"
+    if not target.isdigit() or not limit.isdigit():
+        await matcher.finish(usage)
+    if by_group:
+        entries = await audit_log.search(gid=target, limit=int(limit))
+    else:
+        entries = await audit_log.search(uid=target, limit=int(limit))
+    if not entries:
+        await matcher.finish(f"[Audit] {target} 没有记录")
+    await matcher.finish(f"[Audit] {target} 最近{len(entries)}条记录\n" + "\n".join(map(format_audit_entry, entries)))
 
 
 # Module memberManager end
@@ -966,18 +3612,72 @@ async def on_handle(matcher: Matcher, event: Event):
 bv_api = "https://api.bilibili.com/x/web-interface/view?bvid="
 av_api = "https://api.bilibili.com/x/web-interface/view?avid="
 
-pattern_url = re.compile(
-    r"(http:)?(https:)?(//)?((([a-zA-Z0-9_-])+(\.)?){1,2}\.)?(bilibili.com)+(:\d+)?(\/((\.)?(\?)?=?&?%?["
-    r"#!a-zA-Z0-9_-](\?)?)*)*$")
+pattern_video = re.compile(r"bilibili\.com/video/(BV[0-9A-Za-z]{10}|av\d+)", re.IGNORECASE)
+pattern_short = re.compile(r"b23\.tv/([0-9A-Za-z]+)")
+pattern_id = re.compile(r"(BV[0-9A-Za-z]{10})|av(\d+)", re.IGNORECASE)
+
 
+class BilibiliVideos(object):
+    """视频信息缓存
 
-async def get_video_info_msg(bv: str):
-    url = bv_api + bv
-    res = await get(url)
-    out = res.json()
-    if out["code"] != 0:
+    同一个视频按BV号和AV号各缓存一份, 不存在的视频也缓存一段时间;
+    b23.tv短链接解析结果单独缓存, 同时查询同一个视频时只请求一次"""
+
+    def __init__(self, ttl: float):
+        object.__init__(self)
+        self.videos = TTLCache(1024, ttl)  # "BVxxx"/"av123" -> data | None
+        self.short_links = TTLCache(1024, 24 * 3600)  # 短链接 -> "BVxxx"/"av123" | None
+        self.pending = SingleFlight()
+
+    @staticmethod
+    def normalize(video_id: str) -> str | None:
+        match = pattern_id.fullmatch(video_id)
+        if match is None:
+            return None
+        return match.group(1) if match.group(1) else "av" + match.group(2)
+
+    async def resolve_short(self, code: str) -> str | None:
+        if code in self.short_links:
+            return self.short_links.get(code)
+        return await self.pending.run("b23.tv/" + code, lambda: self.fetch_short(code))
+
+    async def fetch_short(self, code: str) -> str | None:
+        try:
+            r = await get("https://b23.tv/" + code, cache=False)
+            match = pattern_video.search(r.headers.get("location", ""))
+        except httpx.HTTPError:
+            return None
+        video_id = self.normalize(match.group(1)) if match else None
+        self.short_links.set(code, video_id)
+        return video_id
+
+    async def fetch(self, video_id: str) -> dict | None:
+        url = av_api + video_id[2:] if video_id.startswith("av") else bv_api + video_id
+        try:
+            out = (await get(url)).json()
+        except (httpx.HTTPError, ValueError):
+            return None
+        if out["code"] != 0:
+            self.videos.set(video_id, None, 60)
+            return None
+        data: dict = out["data"]
+        self.videos.set(data["bvid"], data)
+        self.videos.set(f"av{data['aid']}", data)
+        return data
+
+    async def get(self, video_id: str) -> dict | None:
+        video_id = self.normalize(video_id)
+        if video_id is None:
+            return None
+        if video_id in self.videos:
+            return self.videos.get(video_id)
+        return await self.pending.run(video_id, lambda: self.fetch(video_id))
+
+
+async def get_video_info_msg(video_id: str):
+    data = await bilibili_videos.get(video_id)
+    if data is None:
         return None
-    data: dict = out["data"]
     pic_url: str = data["pic"]
     title: str = data["title"]
     desc: str = data["desc"]
@@ -991,57 +3691,59 @@ async def get_video_info_msg(bv: str):
     return msg
 
 
-@on_command("bilibili", aliases={"bv"}).handle()
-async def on_handle(matcher: Matcher, event: Event):
-    if not utils.get_state("bilibili"):
-        return
-    arg = parse_arg(event.get_plaintext())
-    if len(arg) != 1:
-        await matcher.finish(
-            "[Bilibili] 获取视频信息 -> /bilibili <bv: str> 别名 /bv\n灵感来源于github (catandA/BilibiliBot-1)")
-    bv = arg[0]
-    info = await get_video_info_msg(bv)
+async def find_videos(text: str) -> list[str]:
+    """找出消息中的视频链接和短链接, 返回去重后的视频号"""
+    video_ids = [bilibili_videos.normalize(match) for match in pattern_video.findall(text)]
+    short_codes = pattern_short.findall(text)
+    if short_codes:
+        video_ids += await asyncio.gather(*(bilibili_videos.resolve_short(code) for code in short_codes))
+    return list(dict.fromkeys(video_id for video_id in video_ids if video_id is not None))
+
+
+@command("bilibili", aliases={"bv"}, module="bilibili", args=[Arg("video")], limit="bilibili",
+         usage="[Bilibili] 获取视频信息 -> /bilibili <bv|av|b23.tv链接> 别名 /bv\n灵感来源于github (catandA/BilibiliBot-1)")
+async def on_handle(matcher: Matcher, video: str):
+    video_ids = await find_videos(video) or [video]
+    info = await get_video_info_msg(video_ids[0])
     if info is None:
-        await matcher.finish(f"[Bilibili] {bv} 视频不存在, 此指令只能根据BV号查询, 暂时不支持AV")
+        await matcher.finish(f"[Bilibili] {video} 视频不存在")
     await matcher.finish(info)
 
 
-@on_message().handle()
+@on_message(handlers=[trace_matcher]).handle()
 async def on_handle(matcher: Matcher, event: Event):
     """Find url"""
+    if not utils.get_state("bilibili"):
+        return
     msg = event.get_plaintext()
-    if utils.get_state("bilibili"):
-        # Match for bilibili
-        all_matches = re.findall(pattern_url, msg)
-        match: tuple[str]
-        for match in all_matches:
-            ur: str = match[9][1:].split("?")[0]
-            bv: str = ur.replace("/", "")
-            try:
-                await matcher.send(await get_video_info_msg(bv))
-            except TypeError:
-                await matcher.send(f"[Bilibili] {bv} 不是正确的BV号")
+    if "bilibili.com" not in msg and "b23.tv" not in msg:
+        return
+    gid = getattr(event, "group_id", None)
+    for video_id in await find_videos(msg):
+        data = await bilibili_videos.get(video_id)
+        if data is None:
+            continue
+        if gid is not None:
+            # 同一个群在一段时间内只发送一次同一个视频
+            if (gid, data["bvid"]) in recent_videos:
+                continue
+            recent_videos.set((gid, data["bvid"]), True)
+        await matcher.send(await get_video_info_msg(data["bvid"]))
 
 
 utils.init_module("bilibili")
+utils.init_value("bilibili", "cache-ttl", 600)  # 视频信息缓存时间(秒)
+utils.init_value("bilibili", "repost-window", 300)  # 同一个群内不重复发送同一视频的时间(秒)
+bilibili_videos = BilibiliVideos(utils.init_value("bilibili", "cache-ttl"))
+recent_videos = TTLCache(4096, utils.init_value("bilibili", "repost-window"))
 
 
 # Module Bilibili end
 
 # Module Spammer start
-@on_command("spammer").handle()
-async def on_handle(matcher: Matcher, event: GroupMessageEvent):
-    msg = event.get_plaintext()
-    if event.get_user_id() not in utils.get_admins():
-        return
-    arg = parse_arg(msg)
-    if len(arg) < 2:
-        await matcher.finish("[Spammer] 刷屏器 -> /spammer <count: int> <message: str>")
-    try:
-        count = int(arg[0])
-    except ValueError:
-        await matcher.finish("[Spammer] count must be a integer")
-    message = Message(" ".join(arg[1:]))
+@command("spammer", admin=True, args=[Arg("count", int), Arg("message", Message, rest=True)],
+         usage="[Spammer] 刷屏器 -> /spammer <count: int> <message: str>")
+async def on_handle(matcher: Matcher, event: GroupMessageEvent, count: int, message: Message):
     for i in range(count):
         await matcher.send(message)
         await asyncio.sleep(0.05)  # Anti MA HUA TENG
@@ -1050,14 +3752,11 @@ async def on_handle(matcher: Matcher, event: GroupMessageEvent):
 # Module Spammer end
 
 # Module ServiceState start
-@on_command("services").handle()
-async def on_handle(matcher: Matcher, event: Event):
+@command("services", module="service-status", args=[Arg("arg", many=True)])
+async def on_handle(matcher: Matcher, event: Event, arg: list[str]):
     """Handle services state"""
-    if not utils.get_state("service-status"):
-        return
     api_dict: dict = utils.init_value("service-status", "api-list")
     timeout = utils.init_value("service-status", "timeout")
-    arg = parse_arg(event.get_plaintext())
     msg: str = "[ServiceStatus] "
     if len(api_dict) == 0 and len(arg) == 0:
         msg += "\n队列中无服务, 使用/services add <name> <api> [body]添加服务"
@@ -1065,7 +3764,7 @@ async def on_handle(matcher: Matcher, event: Event):
         msg += "服务状态\n如果需要该命令的帮助请输入 /services help"
         for name, value in api_dict.items():
             try:
-                r = await get(value["service"], params=value["data"], timeout=timeout)
+                r = await get(value["service"], params=value["data"], timeout=timeout, cache=False)
                 status = r.status_code
                 msg += f"\n[{status}] {name}"
             except Exception:
@@ -1100,11 +3799,14 @@ utils.init_value("service-status", "timeout", 5)
 # Module ServerState end
 
 # Module LunarClient start
+LUNARCLIENT_METADATA_API = "launcher/metadata?os=win32&os_release=0&arch=x64&launcher_version=2.15.2"
+
+
 async def get_lunarclient_metadata(api: str):
     return (await get(api)).json()
 
 
-async def get_lunarclient_version(api: str, version: str, branch: str, module: str) -> dict:
+async def get_lunarclient_version(api: str, version: str, branch: str, module: str, cache: bool = True) -> dict:
     """Get a version's json"""
     data = {
         "hwid": "PRIVATE",
@@ -1119,7 +3821,7 @@ async def get_lunarclient_version(api: str, version: str, branch: str, module: s
         "branch": branch,
         "module": module
     }
-    r = await post(api, params={}, data=json.dumps(data))
+    r = await post(api, params={}, data=json.dumps(data), cache=cache)
     return r.json()
 
 
@@ -1149,12 +3851,143 @@ def get_lunarclient_artifacts(version_json: dict) -> dict:
     return out
 
 
-@on_command("lunarclient", aliases={"lunar"}).handle()
-async def on_handle(event: Event, matcher: Matcher):
-    if not utils.get_state("lunarclient"):
-        return
-    arg: list = parse_arg(event.get_plaintext())
-    metadata_api = "launcher/metadata?os=win32&os_release=0&arch=x64&launcher_version=2.15.2"
+class LunarClientWatcher(object):
+    """定时检查LunarClient元数据和关注版本的工件, 有变化时通知 bot.notify-groups
+
+    元数据使用条件请求(If-None-Match/If-Modified-Since), 304或响应内容哈希不变时不解析;
+    只保存用于比较的快照(版本列表、新闻、工件表)及其哈希. 使用共享存储时通过 update() 原子地替换快照,
+    多个进程同时发现变化也只有一个进程会发送通知"""
+
+    def __init__(self, store: SharedStore | None = None):
+        object.__init__(self)
+        self.store = store
+        self.state_json = os.path.join(utils.config_dir, "lunarclient-watch.json")
+        self.state: dict[str, dict] = {}
+        if self.store is None and os.path.isfile(self.state_json):
+            with open(self.state_json, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        self.validators: dict[str, str] = {}  # 条件请求用的 ETag/Last-Modified
+        self.digests: dict[str, str] = {}  # key -> 上次看到的响应内容哈希
+
+    def swap(self, key: str, snapshot: dict) -> dict | None:
+        """保存新快照, 内容有变化时返回旧快照; 第一次看到时只记录不通知"""
+        digest = hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode("utf-8")).hexdigest()
+        new = {"hash": digest, "snapshot": snapshot}
+        if self.store is not None:
+            previous = []
+            self.store.update("lunarclient-watch", key, lambda old: previous.append(old) or new)
+            old = previous[0]
+        else:
+            old = self.state.get(key)
+            if old is None or old["hash"] != digest:
+                self.state[key] = new
+                with open(self.state_json, "w", encoding="utf-8") as f:
+                    json.dump(self.state, f, indent=4, ensure_ascii=False)
+        if old is None or old["hash"] == digest:
+            return None
+        return old["snapshot"]
+
+    def changed(self, key: str, content: bytes) -> str | None:
+        """内容和上次处理过的不同时返回新的哈希, 调用者处理成功后再写入 self.digests"""
+        digest = hashlib.sha256(content).hexdigest()
+        return None if self.digests.get(key) == digest else digest
+
+    async def check_metadata(self, api: str) -> str | None:
+        headers = {}
+        if "etag" in self.validators:
+            headers["If-None-Match"] = self.validators["etag"]
+        if "last-modified" in self.validators:
+            headers["If-Modified-Since"] = self.validators["last-modified"]
+        r = await get(api + LUNARCLIENT_METADATA_API, cache=False, headers=headers)
+        if r.status_code != 200:
+            return None
+        digest = self.changed("metadata", r.content)
+        if digest is None:
+            return None
+        metadata = r.json()
+        new = {
+            "versions": get_support_lunarclient_versions(metadata),
+            "news": {post["title"]: post.get("excerpt", "") for post in get_lunarclient_news(metadata)}
+        }
+        old = self.swap("metadata", new)
+        # 解析和保存成功后才记录, 否则下次检查时会把这次的变化当成没有变化
+        self.digests["metadata"] = digest
+        for header in ("etag", "last-modified"):
+            if header in r.headers:
+                self.validators[header] = r.headers[header]
+        if old is None:
+            return None
+        lines = []
+        added, removed, _ = diff_keys(dict.fromkeys(old["versions"]), dict.fromkeys(new["versions"]))
+        if added:
+            lines.append("新增版本: " + ", ".join(added))
+        if removed:
+            lines.append("移除版本: " + ", ".join(removed))
+        added, _, _ = diff_keys(old["news"], new["news"])
+        lines.extend(f"新闻: {title}\n{new['news'][title]}" for title in added)
+        return "[LunarClient] 元数据更新\n" + "\n".join(lines) if lines else None
+
+    async def check_version(self, api: str, version: str, module: str, branch: str) -> str | None:
+        key = f"version/{version}/{module}/{branch}"
+        res = await get_lunarclient_version(api + "launcher/launch", version, branch, module, cache=False)
+        artifacts = get_lunarclient_artifacts(res)
+        digest = self.changed(key, json.dumps(artifacts, sort_keys=True).encode("utf-8"))
+        if digest is None:
+            return None
+        old = self.swap(key, artifacts)
+        self.digests[key] = digest
+        if old is None:
+            return None
+        added, removed, changed = diff_keys(old, artifacts)
+        lines = [f"{label}: {', '.join(names)}" for label, names in
+                 (("新增", added), ("移除", removed), ("更新", changed)) if names]
+        return f"[LunarClient] {version}-{module} ({branch}) 工件变化\n" + "\n".join(lines) if lines else None
+
+    async def check(self):
+        api: str = utils.init_value("lunarclient", "api")
+        api = api if api.endswith("/") else api + "/"
+        checks = [self.check_metadata(api)]
+        checks += [self.check_version(api, watch["version"], watch["module"], watch["branch"])
+                   for watch in utils.init_value("lunarclient-watch", "versions")]
+        for result in await asyncio.gather(*checks, return_exceptions=True):
+            if isinstance(result, str):
+                await notify_groups(result)
+            elif isinstance(result, (KeyError, TypeError, ValueError)):
+                traceback.print_exception(result)  # 返回格式变化
+            # 网络错误等下一次再检查
+
+
+def diff_keys(old: dict, new: dict) -> tuple[list[str], list[str], list[str]]:
+    """返回 (新增, 移除, 值变化) 的键"""
+    added = [key for key in new if key not in old]
+    removed = [key for key in old if key not in new]
+    changed = [key for key in new if key in old and old[key] != new[key]]
+    return added, removed, changed
+
+
+async def on_lunarclient_watch(args: dict):
+    # 没有需要通知的群时不请求上游
+    if utils.get_state("lunarclient-watch") and utils.get_notify_groups():
+        await lunarclient_watcher.check()
+
+
+utils.init_module("lunarclient-watch")
+utils.init_value("lunarclient-watch", "interval", 60)  # 检查间隔(秒)
+# 关注的版本, 例如 {"version": "1.8.9", "module": "lunar", "branch": "master"}
+utils.init_value("lunarclient-watch", "versions", [])
+lunarclient_watcher = LunarClientWatcher(store)
+scheduler.register("lunarclient-watch", on_lunarclient_watch)
+
+
+@driver.on_startup
+async def on_startup_lunarclient_watch():
+    interval = utils.init_value("lunarclient-watch", "interval")
+    scheduler.schedule("lunarclient-watch", time.time() + interval, "lunarclient-watch", interval=interval)
+
+
+@command("lunarclient", aliases={"lunar"}, module="lunarclient", limit="lunarclient",
+         args=[Arg("arg", many=True)])
+async def on_handle(matcher: Matcher, arg: list[str]):
     api: str = utils.init_value("lunarclient", "api")
     api = api if api.endswith("/") else api + "/"
     if len(arg) == 0:
@@ -1170,7 +4003,7 @@ async def on_handle(event: Event, matcher: Matcher):
         # metadata query
         msg: str = "[LunarClient] 元数据:"
         # Unofficial no need args. Official API need arg os;os_release;arch;launcher_version
-        api += metadata_api
+        api += LUNARCLIENT_METADATA_API
         # Do request
         res = await get_lunarclient_metadata(api)
         versions = get_support_lunarclient_versions(res)
@@ -1187,7 +4020,7 @@ async def on_handle(event: Event, matcher: Matcher):
         version = arg[1]
         module = arg[2]
         branch = arg[3]
-        api1 = api + metadata_api
+        api1 = api + LUNARCLIENT_METADATA_API
         api += "launcher/launch"
         metadata = await get_lunarclient_metadata(api1)
         versions = get_support_lunarclient_versions(metadata)
@@ -1205,7 +4038,7 @@ async def on_handle(event: Event, matcher: Matcher):
         else:
             await matcher.finish(msg)
     elif len(arg) == 1 and arg[0] == "news":
-        api += metadata_api
+        api += LUNARCLIENT_METADATA_API
         metadata = await get_lunarclient_metadata(api)
         news = get_lunarclient_news(metadata)
         msg = "[LunarClient] 启动器新闻"
@@ -1219,3 +4052,152 @@ async def on_handle(event: Event, matcher: Matcher):
 utils.init_module("lunarclient")
 utils.init_value("lunarclient", "api", "https://api.lunarclientprod.com")
 # Module LunarClient end
+
+
+# Module Profiler start
+class SamplingProfiler(object):
+    """在后台线程中定时采样事件循环所在线程的调用栈, 开销与被采样的代码无关"""
+
+    def __init__(self, thread_id: int, interval: float):
+        object.__init__(self)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.stopped = threading.Event()
+        self.switch_interval = sys.getswitchinterval()
+        self.thread = threading.Thread(target=self.run, name="zzxbot-profiler", daemon=True)
+
+    @staticmethod
+    def label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+
+    def start(self):
+        # 采样线程需要拿到GIL才能读取调用栈, 缩短切换间隔以免只采到事件循环空闲(select)的时刻
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, self.interval / 10))
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        sys.setswitchinterval(self.switch_interval)
+
+    def top(self, limit: int, predicate: Callable[[str], bool] = lambda label: True) -> list[tuple[str, int, int]]:
+        """返回 (函数, 自身采样数, 总采样数), 按自身采样数排序"""
+        own: Counter[str] = Counter()
+        total: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        labels = [label for label in total if predicate(label)]
+        labels.sort(key=lambda label: (own[label], total[label]), reverse=True)
+        return [(label, own[label], total[label]) for label in labels[:limit]]
+
+    def folded(self) -> str:
+        """flamegraph.pl / speedscope 使用的折叠栈格式"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.items())
+
+
+async def measure_loop_lag(duration: float, interval: float = 0.05) -> list[float]:
+    """测量事件循环延迟: 每次sleep实际多等待的时间(秒)"""
+    lags = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+
+def format_loop_lag(lags: list[float]) -> str:
+    if not lags:
+        return "事件循环延迟: 无数据"
+    lags = sorted(lags)
+    p95 = lags[min(len(lags) - 1, int(len(lags) * 0.95))]
+    return (f"事件循环延迟: 平均 {sum(lags) / len(lags) * 1000:.1f}ms, "
+            f"p95 {p95 * 1000:.1f}ms, 最大 {lags[-1] * 1000:.1f}ms")
+
+
+profiling = False
+PLUGIN_FILE = os.path.basename(__file__)
+
+
+@command("profile", module="profiler", admin=True, args=[Arg("arg", many=True)])
+async def on_handle(matcher: Matcher, arg: list[str]):
+    """采样/跟踪一段时间内的热点函数"""
+    global profiling
+    dump = "--dump" in arg
+    arg = [a for a in arg if a != "--dump"]
+    mode = arg[1] if len(arg) >= 2 else "sample"
+    if (arg and not arg[0].isdigit()) or mode not in ("sample", "trace"):
+        await matcher.finish("[Profile] 分析机器人性能 -> /profile [seconds] [sample|trace] [--dump]\n"
+                             "sample: 低开销采样(默认), trace: cProfile确定性分析(开销较大)")
+    if profiling:
+        await matcher.finish("[Profile] 已经有一个分析正在进行")
+    seconds = min(int(arg[0]) if arg else 10, utils.init_value("profiler", "max-seconds"))
+    profiling = True
+    await matcher.send(f"[Profile] 开始{'采样' if mode == 'sample' else '跟踪'} {seconds}s")
+    profile_dir = os.path.join(utils.config_dir, "profiles")
+    path = os.path.join(profile_dir, f"profile-{int(time.time())}.{'folded' if mode == 'sample' else 'prof'}")
+    try:
+        if mode == "sample":
+            sampler = SamplingProfiler(threading.get_ident(), utils.init_value("profiler", "interval") / 1000)
+            sampler.start()
+            try:
+                lags = await measure_loop_lag(seconds)
+            finally:
+                sampler.stop()
+            samples = sum(sampler.stacks.values())
+            lines = [f"{label} {own * 100 / samples:.1f}% (total {total * 100 / samples:.1f}%)"
+                     for label, own, total in sampler.top(10) if own] if samples else []
+            plugin_lines = [f"{label} {total * 100 / samples:.1f}%"
+                            for label, own, total in sampler.top(5, lambda label: PLUGIN_FILE in label)] \
+                if samples else []
+            msg = f"[Profile] 采样 {seconds}s, {samples} 个样本\n{format_loop_lag(lags)}"
+            if dump:
+                os.makedirs(profile_dir, exist_ok=True)
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(sampler.folded())
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                lags = await measure_loop_lag(seconds)
+            finally:
+                profiler.disable()
+            stats = pstats.Stats(profiler)
+            functions = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)  # 按自身耗时
+            lines = [f"{name} ({os.path.basename(file)}:{line}) {tottime * 1000:.1f}ms ({calls} calls)"
+                     for (file, line, name), (_, calls, tottime, _, _) in functions[:10]]
+            plugin_functions = sorted((item for item in stats.stats.items() if item[0][0] == __file__),
+                                      key=lambda item: item[1][3], reverse=True)  # 按总耗时
+            plugin_lines = [f"{name} ({line}) {cumtime * 1000:.1f}ms ({calls} calls)"
+                            for (_, line, name), (_, calls, _, cumtime, _) in plugin_functions[:5]]
+            msg = f"[Profile] 跟踪 {seconds}s\n{format_loop_lag(lags)}"
+            if dump:
+                os.makedirs(profile_dir, exist_ok=True)
+                stats.dump_stats(path)
+    finally:
+        profiling = False
+    msg += "\n热点函数:\n" + ("\n".join(lines) if lines else "无")
+    msg += "\n插件函数:\n" + ("\n".join(plugin_lines) if plugin_lines else "无")
+    if dump:
+        msg += f"\n已保存到 {path}"
+    await matcher.finish(msg)
+
+
+utils.init_module("profiler")
+utils.init_value("profiler", "interval", 5)  # 采样间隔(ms)
+utils.init_value("profiler", "max-seconds", 300)  # 最长分析时间(秒)
+# Module Profiler end